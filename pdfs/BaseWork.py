@@ -5,6 +5,14 @@ from .TermOutput import msg
 from .Crossref import crossrefLookup
 from .Bibtex import bibtexFields, makeBibtex, makeCiteKey
 
+# Crossref fields read by the work types, cite keys and refresh. The full
+# Crossref message is kept compressed beside them and loaded on demand.
+metaFields = {'DOI', 'type', 'title', 'author', 'editor', 'issued', 'container-title', 'event',
+              'publisher', 'publisher-location', 'volume', 'issue', 'page', 'deposited'}
+
+def trimMeta(meta):
+    return {k: v for k, v in meta.items() if k in metaFields}
+
 def _mergeDicts(*dicts):
     new_dict = dict()
     for d in reversed(dicts):
@@ -56,29 +64,53 @@ class Work(metaclass=TypeMapMeta):
             if field not in okFields:
                 setattr(cls, field, lambda s: None)
 
-    def __init__(self, meta, fileLabels=None, citeKey=None, tags=None, files=None, md5s=None, bibtex=None, importDate=None):
+    def __init__(self, meta=None, fileLabels=None, citeKey=None, tags=None, files=None, md5s=None, bibtex=None, importDate=None, doi=None, loadMeta=None, bibtexEdited=False, rawMeta=None, loadRaw=None):
         if type(self) is Work:
             raise RuntimeError("Do not instantiate {} directly".format(type(self).__name__))
-        self.meta = meta
+        if meta is not None and not metaFields.issuperset(meta):
+            rawMeta = rawMeta or meta
+            meta = trimMeta(meta)
+        self._meta = meta
+        self._loadMeta = loadMeta
+        self._rawMeta = rawMeta
+        self._loadRaw = loadRaw
+        self._doi = doi
         self.tags = tags or list()
         self.files = files or list()
         self.md5s = md5s or list()
         self.fileLabels = fileLabels or list()
-        self._citeKey = citeKey or makeCiteKey(meta)
+        self._citeKey = citeKey or makeCiteKey(self.meta)
         self.bibtex = bibtex or self.bibtexFromMetadata()
-
-        if importDate:
-            self.importDate = dateutil.parser.parse(importDate)
-        else:
-            self.importDate = datetime.datetime.now(dateutil.tz.tzlocal())
-
-        dt = meta['issued']['date-parts'][0].copy()
+        self.bibtexEdited = bibtexEdited
+        self._importDate = importDate or datetime.datetime.now(dateutil.tz.tzlocal())
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = self._loadMeta()
+        return self._meta
+
+    @property
+    def rawMeta(self):
+        if self._rawMeta is None and self._loadRaw:
+            self._rawMeta = self._loadRaw()
+        return self._rawMeta or self.meta
+
+    @property
+    def importDate(self):
+        if isinstance(self._importDate, str):
+            self._importDate = dateutil.parser.parse(self._importDate)
+        return self._importDate
+
+    @property
+    def date(self):
+        dt = self.meta['issued']['date-parts'][0].copy()
         if len(dt) == 1:
             dt += [1, 1]
         elif len(dt) == 2:
             dt += [1]
 
-        self.date = datetime.datetime(*dt)
+        return datetime.datetime(*dt)
 
     def timestamp(self):
         return '{:%Y-%m-%d %H:%M}'.format(self.importDate)
@@ -95,7 +127,7 @@ class Work(metaclass=TypeMapMeta):
 
     @classmethod
     def from_db(cls, **kwargs):
-        tp = kwargs['meta']['type']
+        tp = kwargs.pop('type', None) or kwargs['meta']['type']
         try:
             return cls._typeMap[tp](**kwargs)
         except KeyError:
@@ -113,7 +145,8 @@ class Work(metaclass=TypeMapMeta):
         return dict(meta=self.meta, citeKey=self.key(), tags=self.tags, 
                     files=self.files, fileLabels=self.fileLabels, 
                     importDate=self.importDate.isoformat(),
-                    md5s=self.md5s, bibtex=self.bibtex)
+                    md5s=self.md5s, bibtex=self.bibtex, bibtexEdited=self.bibtexEdited,
+                    rawMeta=self._rawMeta)
 
     def bibtexFromMetadata(self):
         btexDict = dict()
@@ -149,6 +182,8 @@ class Work(metaclass=TypeMapMeta):
         return dict()
 
     def _dict_doi(self):
+        if self._meta is None and self._doi:
+            return {'doi': self._doi}
         return self._mkMetaDict('doi', 'DOI')
     
     def _dict_address(self):
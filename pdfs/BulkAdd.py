@@ -0,0 +1,144 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .BaseWork import Work
+from .Crossref import crossrefLookupMany
+from .Exceptions import AbortException, CrossrefException, WorkExistsException
+from .ExtractDoi import doiCandidates, entryFromPdf, entryFromUser
+from .ReadPdf import scanPdf, getPdfTxt, hasPdfTxt, storePdfTxt, md5sum
+from .TermOutput import msg
+from .TextSearch import writerProcs
+from .AnsiBib import printWork
+
+def findPdfs(root):
+    fnames = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d[0] != '.')
+        fnames += [os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(".pdf") and f[0] != '.']
+    return fnames
+
+# Candidates per file fetched in each batched Crossref round
+lookahead = 4
+
+def _resolveCandidates(candidates):
+    # Each file's candidates come in stages (see doiCandidates). As in
+    # entryFromPdf, the first stage with a DOI that resolves decides, so DOIs
+    # cited in the reference list only count when nothing earlier resolved.
+    stages = {fname: deque(deque(x) for x in dois) for fname, dois in candidates}
+    works = {fname: [] for fname, _ in candidates}
+    failed = set()
+
+    while True:
+        batch = {}
+        for f, q in stages.items():
+            while q and not q[0] and not works[f]:
+                q.popleft()
+            if q and q[0] and len(works[f]) < 2 and f not in failed:
+                batch[f] = [q[0].popleft() for _ in range(min(lookahead, len(q[0])))]
+        if not batch:
+            break
+
+        try:
+            crossrefLookupMany(doi for dois in batch.values() for doi in dois)
+        except CrossrefException as e:
+            msg.debug("Batch lookup failed: %s", e)
+
+        for fname, dois in batch.items():
+            try:
+                for doi in dois:
+                    try:
+                        e = Work.from_doi(doi)
+                    except ValueError:
+                        continue
+                    if e:
+                        works[fname].append(e)
+                        if len(works[fname]) > 1:
+                            break
+            except CrossrefException as e:
+                msg.warning(str(e))
+                failed.add(fname)
+
+    return [(fname, [x for stage in dois for x in stage], works[fname], fname in failed) for fname, dois in candidates]
+
+def bulkAdd(db, root, tags, procs=None):
+    fnames = findPdfs(root)
+    msg.info("Found %d PDF files under %s", len(fnames), root)
+
+    pending, seen = [], set()
+    for fname in fnames:
+        md5 = md5sum(fname)
+        other = db.find(md5=md5)
+        if other:
+            msg.info("%s already in repository as %s", fname, other.key())
+        elif md5 not in seen:
+            seen.add(md5)
+            pending.append((fname, md5))
+
+    # Extracted text is committed to the cache file by file and Crossref
+    # results chunk by chunk, so other pdfs processes can write to it too.
+    toScan = [(f, md5) for f, md5 in pending if not hasPdfTxt(md5)]
+    if toScan:
+        msg.info("Extracting text from %d files using %s processes", len(toScan), procs or os.cpu_count())
+        with ProcessPoolExecutor(procs) as pool:
+            for (fname, md5), (pages, err) in zip(toScan, pool.map(scanPdf, [f for f, _ in toScan])):
+                if err:
+                    msg.warning("Could not read %s: %s", fname, err)
+                    db.queueReview(fname, "unreadable: " + err)
+                else:
+                    storePdfTxt(md5, pages)
+
+    candidates, nPages = [], 0
+    for fname, md5 in pending:
+        if hasPdfTxt(md5):
+            pages = getPdfTxt(fname, md5)
+            nPages += len(pages)
+            candidates.append((fname, list(doiCandidates(fname, pages))))
+
+    msg.info("Resolving DOIs for %d files", len(candidates))
+    resolved = _resolveCandidates(candidates)
+
+    added = 0
+    with db.transaction(), db.textSearch.batch(writerProcs(nPages)):
+        for fname, dois, works, failed in resolved:
+            if failed:
+                db.queueReview(fname, "lookup failed", dois)
+                continue
+            if len(works) != 1:
+                db.queueReview(fname, "no DOI found" if not works else "ambiguous DOI", dois)
+                continue
+
+            entry, = works
+            other = db.find(doi=entry.doi())
+            if other:
+                db.queueReview(fname, "DOI already in repository as " + other.key(), dois)
+                continue
+
+            try:
+                db.add(entry, fname, [], tags)
+            except WorkExistsException as e:
+                msg.warning(str(e))
+                continue
+            printWork(entry)
+            added += 1
+
+    msg.info("Added %d of %d files, %d awaiting review", added, len(fnames), len(db.reviewQueue))
+
+def reviewQueued(db, tags):
+    for fname, reason, _ in db.reviewQueue:
+        if not os.path.exists(fname):
+            msg.warning("%s no longer exists, dropping it from the review queue", fname)
+            db.dequeueReview(fname)
+            continue
+
+        msg.info("Reviewing %s (%s)", fname, reason)
+        try:
+            entry = entryFromPdf(fname) or entryFromUser(fname)
+            db.add(entry, fname, [], tags)
+            printWork(entry)
+        except WorkExistsException as e:
+            msg.warning(str(e))
+        except AbortException:
+            msg.warning("Review stopped, %s is still queued", fname)
+            break
+        db.dequeueReview(fname)
@@ -1,27 +1,241 @@
+import atexit
+import os
 import pickle
+import sqlite3
+import threading
 import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
 from .Bases import Singleton
 from .TermOutput import msg
 
+_schema = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns       TEXT NOT NULL,
+    key      TEXT NOT NULL,
+    value    BLOB NOT NULL,
+    size     INTEGER NOT NULL DEFAULT 0,
+    created  REAL NOT NULL DEFAULT 0,
+    accessed REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (ns, key)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    ns     TEXT PRIMARY KEY,
+    hits   INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS policy (
+    ns       TEXT PRIMARY KEY,
+    maxBytes INTEGER,
+    ttl      REAL
+);
+"""
+
+# Per-namespace limits used until overridden with `pdfs cache`. maxBytes
+# counts compressed bytes; ttl is in seconds. None means unlimited.
+defaultPolicies = {"DOI": dict(maxBytes=64<<20, ttl=180*86400),
+                   "NODOI": dict(maxBytes=4<<20, ttl=30*86400),
+                   "PDF": dict(maxBytes=1<<30, ttl=None)}
+
 class RequestCache(metaclass=Singleton):
-    def __init__(self, cacheFile=None):
+    def __init__(self, cacheFile=None, legacyFile=None):
         self.cacheFile = cacheFile
+        self.legacyFile = legacyFile
+        self.lock = threading.RLock()
+        self.conn = None
+        self.deferred = 0
+        self.hits, self.misses = Counter(), Counter()
+        self.touched = {}
+        self.written = set()
+        atexit.register(self.close)
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.cacheFile or ":memory:", check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.executescript(_schema)
+            cols = [x[1] for x in self.conn.execute("PRAGMA table_info(cache)")]
+            for col, tp in [("size", "INTEGER"), ("created", "REAL"), ("accessed", "REAL")]:
+                if col not in cols:
+                    self.conn.execute("ALTER TABLE cache ADD COLUMN {} {} NOT NULL DEFAULT 0".format(col, tp))
+                    if col == "size":
+                        self.conn.execute("UPDATE cache SET size=length(value)")
+                    else:
+                        self.conn.execute("UPDATE cache SET {}=?".format(col), (time.time(),))
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cacheAccessed ON cache(ns, accessed)")
+            self.conn.commit()
+            if self.legacyFile and os.path.exists(self.legacyFile):
+                self._migratePickle()
+        return self.conn
+
+    def _migratePickle(self):
+        old = pickle.load(open(self.legacyFile, "rb"))
+        now = time.time()
+        with self.conn:
+            for ns, entries in old.items():
+                for k, v in entries.items():
+                    self._insert(ns, k, self._pack(v), now)
+        os.unlink(self.legacyFile)
+        msg.info("Moved %d cached requests from %s to %s", sum(len(x) for x in old.values()), self.legacyFile, self.cacheFile)
+
+    @staticmethod
+    def _pack(value):
+        return zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _unpack(blob):
+        return pickle.loads(zlib.decompress(blob))
+
+    def _insert(self, ns, key, blob, now):
+        self.conn.execute("INSERT OR REPLACE INTO cache (ns, key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                          (ns, key, blob, len(blob), now, now))
+
+    def policy(self, ns):
+        with self.lock:
+            row = self._connect().execute("SELECT maxBytes, ttl FROM policy WHERE ns=?", (ns,)).fetchone()
+        if row:
+            return dict(maxBytes=row[0], ttl=row[1])
+        return dict(defaultPolicies.get(ns, dict(maxBytes=None, ttl=None)))
+
+    def setPolicy(self, ns, **kwargs):
+        p = self.policy(ns)
+        p.update(kwargs)
+        with self.lock, self._connect():
+            self.conn.execute("INSERT OR REPLACE INTO policy (ns, maxBytes, ttl) VALUES (?, ?, ?)", (ns, p['maxBytes'], p['ttl']))
+
+    def get(self, ns, key):
+        ttl = self.policy(ns)['ttl']
+        with self.lock:
+            row = self._connect().execute("SELECT value, created FROM cache WHERE ns=? AND key=?", (ns, key)).fetchone()
+            if row is None or (ttl and row[1] < time.time() - ttl):
+                self.misses[ns] += 1
+                raise KeyError(key)
+            self.hits[ns] += 1
+            self.touched[ns, key] = time.time()
+        return self._unpack(row[0])
+
+    def contains(self, ns, key):
+        ttl = self.policy(ns)['ttl']
+        with self.lock:
+            row = self._connect().execute("SELECT created FROM cache WHERE ns=? AND key=?", (ns, key)).fetchone()
+        return row is not None and not (ttl and row[0] < time.time() - ttl)
+
+    def put(self, ns, key, value):
+        blob = self._pack(value)
+        with self.lock:
+            self._connect()
+            self._insert(ns, key, blob, time.time())
+            self.written.add(ns)
+            if not self.deferred:
+                self.conn.commit()
+
+    def delete(self, ns, key):
+        with self.lock:
+            self._connect().execute("DELETE FROM cache WHERE ns=? AND key=?", (ns, key))
+            if not self.deferred:
+                self.conn.commit()
+
+    def clear(self, ns):
+        with self.lock, self._connect():
+            self.conn.execute("DELETE FROM cache WHERE ns=?", (ns,))
+            self.conn.execute("DELETE FROM stats WHERE ns=?", (ns,))
+
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self.deferred += 1
         try:
-            self.cache = pickle.load(open(self.cacheFile,"rb"))
-        except FileNotFoundError:
-            msg.info("Started new request cache")
-            self.cache = {}
+            yield
+        finally:
+            with self.lock:
+                self.deferred -= 1
+                if not self.deferred and self.conn is not None:
+                    self.conn.commit()
+
+    def namespaces(self):
+        with self.lock:
+            return [x for x, in self._connect().execute("SELECT ns FROM cache UNION SELECT ns FROM stats UNION SELECT ns FROM policy")]
+
+    def report(self, ns):
+        self.flush()
+        with self.lock:
+            n, size = self._connect().execute("SELECT count(*), coalesce(sum(size), 0) FROM cache WHERE ns=?", (ns,)).fetchone()
+            row = self.conn.execute("SELECT hits, misses FROM stats WHERE ns=?", (ns,)).fetchone() or (0, 0)
+        return dict(entries=n, size=size, hits=row[0], misses=row[1], **self.policy(ns))
 
-    def writeCacheFile(self):
-        pickle.dump(self.cache, open(self.cacheFile,"wb"))
+    def prune(self, ns):
+        p = self.policy(ns)
+        removed = 0
+        with self.lock, self._connect():
+            if p['ttl']:
+                removed += self.conn.execute("DELETE FROM cache WHERE ns=? AND created < ?", (ns, time.time() - p['ttl'])).rowcount
 
-def cachedRequest(name=None):
+            if p['maxBytes'] is not None:
+                total, = self.conn.execute("SELECT coalesce(sum(size), 0) FROM cache WHERE ns=?", (ns,)).fetchone()
+                evict = []
+                for key, size in self.conn.execute("SELECT key, size FROM cache WHERE ns=? ORDER BY accessed", (ns,)):
+                    if total <= p['maxBytes']:
+                        break
+                    evict.append((ns, key))
+                    total -= size
+                self.conn.executemany("DELETE FROM cache WHERE ns=? AND key=?", evict)
+                removed += len(evict)
+        return removed
+
+    def flush(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            with self.conn:
+                self.conn.executemany("UPDATE cache SET accessed=? WHERE ns=? AND key=?",
+                                      ((t, ns, k) for (ns, k), t in self.touched.items()))
+                for ns in set(self.hits) | set(self.misses):
+                    self.conn.execute("INSERT OR IGNORE INTO stats (ns) VALUES (?)", (ns,))
+                    self.conn.execute("UPDATE stats SET hits=hits+?, misses=misses+? WHERE ns=?", (self.hits[ns], self.misses[ns], ns))
+            self.touched, self.hits, self.misses = {}, Counter(), Counter()
+
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            self.flush()
+            for ns in self.written:
+                self.prune(ns)
+            self.written = set()
+            self.conn.close()
+            self.conn = None
+
+class FileHashCache(metaclass=Singleton):
+    def __init__(self, cacheFile=None):
+        self.cacheFile = cacheFile
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cacheFile or ":memory:", check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                                path  TEXT PRIMARY KEY,
+                                inode INTEGER NOT NULL,
+                                size  INTEGER NOT NULL,
+                                mtime INTEGER NOT NULL,
+                                md5   TEXT NOT NULL)""")
+
+    def get(self, path, st):
+        with self.lock:
+            row = self.conn.execute("SELECT inode, size, mtime, md5 FROM hashes WHERE path=?", (path,)).fetchone()
+        if row and tuple(row[:3]) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            return row[3]
+
+    def put(self, path, st, md5):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO hashes (path, inode, size, mtime, md5) VALUES (?, ?, ?, ?, ?)",
+                              (path, st.st_ino, st.st_size, st.st_mtime_ns, md5))
+
+def cachedRequest(name=None, negative=None):
+    # With `negative`, None results are kept in that namespace instead, so
+    # misses expire on their own schedule.
     def _cachedRequest(fn):
         def wrapper(*args, **kwargs):
             rc = RequestCache()
-            if name not in rc.cache:
-                rc.cache[name] = dict()
-            cache = rc.cache[name]
 
             if 'cache_key' in kwargs:
                 if kwargs['cache_key'] is None:
@@ -30,11 +244,45 @@ def cachedRequest(name=None):
             else:
                 x = args[0]
             
-            if x not in cache:
-                msg.debug("%s cache miss", name)
-                time.sleep(0.4)
-                cache[x] = fn(*args, **kwargs)
-                rc.writeCacheFile()
-            return cache[x]
+            try:
+                return rc.get(name, x)
+            except KeyError:
+                pass
+
+            # Probed with contains() first, which leaves the hit and miss
+            # counts alone, so ordinary misses don't count against negative
+            if negative and rc.contains(negative, x):
+                try:
+                    return rc.get(negative, x)
+                except KeyError:
+                    pass
+
+            msg.debug("%s cache miss", name)
+            value = fn(*args, **kwargs)
+            prime(x, value)
+            return value
+
+        def cached(key):
+            rc = RequestCache()
+            return rc.contains(name, key) or bool(negative and rc.contains(negative, key))
+
+        def prime(key, value):
+            rc = RequestCache()
+            if value is None and negative:
+                rc.put(negative, key, None)
+                rc.delete(name, key)
+            else:
+                rc.put(name, key, value)
+                if negative:
+                    rc.delete(negative, key)
+
+        def forget(key):
+            RequestCache().delete(name, key)
+            if negative:
+                RequestCache().delete(negative, key)
+
+        wrapper.cached = cached
+        wrapper.prime = prime
+        wrapper.forget = forget
         return wrapper
     return _cachedRequest
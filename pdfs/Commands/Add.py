@@ -4,24 +4,44 @@ from argcomplete.completers import FilesCompleter
 
 class Add(Command):
     command = 'add'
-    help = "Import new PDF into repository"
+    help = "Import new PDF (or a directory tree of PDFs) into repository"
 
     def set_args(self, subparser):
-        subparser.add_argument('file', metavar='PDFFILE', type=str).completer = FilesCompleter("pdf", directories=False)
+        subparser.add_argument('file', metavar='PDFFILE', nargs='?', type=str).completer = FilesCompleter("pdf", directories=True)
         subparser.add_argument("--doi", "-d", help="Specify DOI for metadata", type=str, default=None)
         subparser.add_argument("--supplementary", "-S", 
                                help="Supplemental files to attach", metavar="FILE", nargs="+", 
                                type=str, default=[]).completer = FilesCompleter(directories=False)
         subparser.add_argument("--tags", "-t", help="Descriptive tags", 
                                nargs="+", type=str, metavar="TAG", default=[]).completer = tagCompleter
+        subparser.add_argument("--jobs", "-j", help="Worker processes for directory imports", type=int, default=None)
+        subparser.add_argument("--review", "-R", help="Interactively add files left in the review queue by directory imports",
+                               action="store_true")
 
     def run(self, args):
+        import os
         from ..Database import Database
         from ..BaseWork import Work
         from ..ExtractDoi import entryFromUser, entryFromPdf
         from ..AnsiBib import printWork
+        from ..Exceptions import UserException
+
+        db = Database(dataDir=args.data_dir, lazy=True)
+        if args.review:
+            from ..BulkAdd import reviewQueued
+            reviewQueued(db, args.tags)
+            return
+
+        if not args.file:
+            raise UserException("PDFFILE required")
+
+        if os.path.isdir(args.file):
+            from ..BulkAdd import bulkAdd
+            if args.doi or args.supplementary:
+                raise UserException("--doi and --supplementary cannot be used with a directory")
+            bulkAdd(db, args.file, args.tags, procs=args.jobs)
+            return
 
-        db = Database(dataDir=args.data_dir)
         if args.doi:
             entry = Work.from_doi(args.doi)
         else:
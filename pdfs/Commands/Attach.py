@@ -15,12 +15,11 @@ class Attach(Command):
         from ..Database import Database
         from ..Exceptions import UserException
 
-        db = Database(dataDir=args.data_dir)
-        try:
-            e = next(x for x in db.works if x.key() == args.key)
-        except StopIteration:
+        db = Database(dataDir=args.data_dir, lazy=True)
+        e = db.find(key=args.key)
+        if not e:
             raise UserException("Key {} not found".format(args.key))
 
         e.tags = sorted((set(e.tags) | set(args.add)) - set(args.remove))
 
-        db.save()
+        db.save(e)
@@ -14,16 +14,17 @@ class Aux2Bib(Command):
         from ..Database import Database
         from ..TermOutput import msg
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=True)
         auxCiteArgs = re.findall(r"\\(?:bibcite|citation)\{([^}]+)\}", open(args.aux, "r").read())
         auxKeys = sorted(set(x.strip() for y in auxCiteArgs for x in y.split(',')))
 
         btexs, missing = [], []
 
         for key in auxKeys:
-            try:
-                btexs.append(next(x.bibtex for x in db.works if x.key() == key))
-            except StopIteration:
+            e = db.find(key=key)
+            if e:
+                btexs.append(e.bibtex)
+            else:
                 missing.append(key)
 
         if btexs:
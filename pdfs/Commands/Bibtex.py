@@ -7,6 +7,8 @@ class Bibtex(Command):
     help = "Dump bibtex for keys"
 
     def set_args(self, subparser):
+        subparser.add_argument("--query", "-q", metavar='QUERY', type=str, default=None,
+                               help="Indexed search, e.g. 'author:smith year:2015..2018 tag:review'")
         subparser.add_argument("--title", "-t", metavar='REGEX', type=str, default=None)
         subparser.add_argument("--author", "-a", metavar='REGEX', type=str, default=None).completer = authorCompleter
         subparser.add_argument("--year", "-y", metavar='REGEX', type=str, default=None)
@@ -18,16 +20,19 @@ class Bibtex(Command):
         from ..Database import Database
         from ..TermOutput import msg
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=not (args.title or args.author or args.year) or bool(args.query))
 
         btexs = []
-        search = any(getattr(args, k) for k in ['title', 'author', 'year', 'tag', 'key'])
+        search = any(getattr(args, k) for k in ['query', 'title', 'author', 'year', 'tag', 'key'])
         if args.all and search:
             msg.error("Search and the --all option are mutually exclusive")
         elif args.all:
             btexs = [x.bibtex for x in sorted(db.works, key=lambda x: x.key())]
         elif search:
-            gen = iter(db.works)
+            if args.query:
+                gen = (r['entry'] for r in db.search(args.query)[0])
+            else:
+                gen = iter(db.works)
 
             def match(g, f, r):
                 if r:
@@ -0,0 +1,77 @@
+from .Command import Command
+from ..Exceptions import UserException
+from ..TermOutput import fg, attr, stylize, msg, wrapWithColor
+
+_units = {'': 1, 'K': 1<<10, 'M': 1<<20, 'G': 1<<30}
+
+def _parseSize(s):
+    s = s.strip().upper().rstrip('B')
+    if s in ('NONE', 'INF'):
+        return None
+    try:
+        if s and s[-1] in _units:
+            return int(float(s[:-1]) * _units[s[-1]])
+        return int(s)
+    except ValueError:
+        raise UserException("Bad size: {}".format(s))
+
+def _parseDays(s):
+    if s.lower() in ('none', 'inf', '0'):
+        return None
+    try:
+        return float(s)*86400
+    except ValueError:
+        raise UserException("Bad number of days: {}".format(s))
+
+def _fmtSize(n):
+    if n is None:
+        return "unlimited"
+    if n < 1<<20:
+        return "{:.1f} KB".format(n/(1<<10))
+    return "{:.1f} MB".format(n/(1<<20))
+
+class Cache(Command):
+    command = 'cache'
+    help = "Report request cache usage and apply eviction policies"
+
+    def set_args(self, subparser):
+        subparser.add_argument("--prune", "-p", help="Evict expired and least recently used entries now", action="store_true")
+        subparser.add_argument("--clear", metavar="NS", help="Drop every entry in a namespace (DOI, PDF, ...)", type=str)
+        subparser.add_argument("--max-size", nargs=2, metavar=("NS", "SIZE"),
+                               help="Size limit for a namespace, e.g. 'PDF 500M' or 'DOI none'")
+        subparser.add_argument("--ttl", nargs=2, metavar=("NS", "DAYS"),
+                               help="Maximum age of entries in a namespace, e.g. 'DOI 90' or 'DOI none'")
+
+    def run(self, args):
+        from ..Cache import RequestCache
+
+        rc = RequestCache()
+
+        if args.max_size:
+            rc.setPolicy(args.max_size[0], maxBytes=_parseSize(args.max_size[1]))
+        if args.ttl:
+            rc.setPolicy(args.ttl[0], ttl=_parseDays(args.ttl[1]))
+        if args.clear:
+            rc.clear(args.clear)
+            msg.info("Cleared %s cache", args.clear)
+        if args.prune:
+            for ns in rc.namespaces():
+                msg.info("Evicted %d entries from %s cache", rc.prune(ns), ns)
+
+        lc = fg("white") + attr("dim")
+        vc = fg("cyan")
+
+        for ns in sorted(rc.namespaces()):
+            r = rc.report(ns)
+            lookups = r['hits'] + r['misses']
+            rate = "{:.1f}%".format(100*r['hits']/lookups) if lookups else "n/a"
+            ttl = "{:g} days".format(r['ttl']/86400) if r['ttl'] else "none"
+
+            fields = [("Entries", str(r['entries'])),
+                      ("Size", "{} (limit {})".format(_fmtSize(r['size']), _fmtSize(r['maxBytes']))),
+                      ("Hit rate", "{} ({} hits, {} misses)".format(rate, r['hits'], r['misses'])),
+                      ("TTL", ttl)]
+
+            msg(stylize(ns, fg("white") + attr("bold")))
+            for l, v in fields:
+                msg(wrapWithColor(stylize("  {:<10}".format(l), lc) + stylize(v, vc), indent=12))
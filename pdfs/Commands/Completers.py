@@ -24,12 +24,12 @@ def citekeyCompleter(**kwargs):
         dd = args.src
     else:
         dd = args.data_dir
-    return  [x for x in Database(dataDir=dd).citeKeys if x.startswith(prefix)]
+    return  [x for x in Database(dataDir=dd, lazy=True).citeKeys if x.startswith(prefix)]
 
 @completerWrapper
 def tagCompleter(**kwargs):
     args, prefix = kwargs['parsed_args'], kwargs['prefix']
-    return [x for x in Database(dataDir=args.data_dir).tags if x.startswith(prefix)]
+    return [x for x in Database(dataDir=args.data_dir, lazy=True).tags if x.startswith(prefix)]
 
 @completerWrapper
 def authorCompleter(**kwargs):
@@ -39,7 +39,7 @@ def authorCompleter(**kwargs):
 @completerWrapper
 def attachmentCompleter(**kwargs):
     args, prefix = kwargs['parsed_args'], kwargs['prefix']
-    e = Database(dataDir=args.data_dir).find(key=args.key)
+    e = Database(dataDir=args.data_dir, lazy=True).find(key=args.key)
     if not e:
         return []
     return [x for x in e.fileLabels if x.lower().startswith(prefix.lower())]
@@ -25,30 +25,18 @@ class Edit(Command):
 
         _keyRe = re.compile(r"\s*@\s*(?:"+'|'.join(bibtexTypes)+r")\s*\{\s*([^\s,]+)\s*,")
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=True)
 
-        try:
-            e = next(x for x in db.works if x.key() == args.key)
-        except StopIteration:
+        e = db.find(key=args.key)
+        if not e:
             raise UserException("Key {} not found".format(args.key))
 
-        if args.add_tags or args.del_tags:
-            e.tags = sorted((set(e.tags) | set(args.add_tags)) - set(args.del_tags))
-            db.save()
-
-        if args.del_attachments:
-            for n in args.del_attachments:
-                db.removeAttachment(args.key, n)
-
-        if args.add_attachments:
-            for n in args.add_attachments:
-                db.attach(args.key, n)
-
+        oldKey, newBib = e.key(), None
         if args.edit_bibtex:
-            oldBib = e.bibtex
-            newBib = spawnEditor(oldBib, 'bib')
-            if oldBib != newBib:
-                oldKey = e.key()
+            newBib = spawnEditor(e.bibtex, 'bib')
+            if newBib == e.bibtex:
+                newBib = None
+            else:
                 newKey = _keyRe.findall(newBib)
                 if len(newKey) != 1:
                     tmpf,tmpfname = tempfile.mkstemp(dir="/tmp", prefix="edit-of-{}.".format(oldKey), suffix=".bib", text=True)
@@ -57,15 +45,30 @@ class Edit(Command):
                     raise UserException("Failed to parse new bibtex entry. Work in progress written to {}".format(tmpfname))
                 newKey = newKey[0]
 
+        with db.transaction(), db.textSearch.batch():
+            if args.add_tags or args.del_tags:
+                e.tags = sorted((set(e.tags) | set(args.add_tags)) - set(args.del_tags))
+                db.save(e)
+
+            if args.del_attachments:
+                for n in args.del_attachments:
+                    db.removeAttachment(args.key, n)
+
+            if args.add_attachments:
+                for n in args.add_attachments:
+                    db.attach(args.key, n)
+
+            if newBib is not None:
                 if newKey != oldKey:
                     msg.info("%s → %s", oldKey, newKey)
-                    e.set_key(newKey)
+                    db.setKey(e, newKey)
 
                 e.bibtex = newBib
-            db.save()
+                e.bibtexEdited = True
+                db.save(e)
 
-        if args.delete_entry:
-            db.delete(args.key)
+            if args.delete_entry:
+                db.delete(e.key())
 
 
 def spawnEditor(text, filetype='txt'):
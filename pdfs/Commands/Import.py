@@ -14,9 +14,10 @@ class Import(Command):
         from ..Database import Database
         from ..AnsiBib import printWork
 
-        dbDest = Database(dataDir=args.data_dir)
-        dbSrc = Database(dataDir=args.src)
+        dbDest = Database(dataDir=args.data_dir, lazy=True)
+        dbSrc = Database(dataDir=args.src, lazy=True)
 
-        for k in args.keys:
-            e = dbDest.copyFromDb(dbSrc, k)
-            printWork(e)
+        with dbDest.transaction(), dbDest.textSearch.batch():
+            for k in args.keys:
+                e = dbDest.copyFromDb(dbSrc, k)
+                printWork(e)
@@ -39,6 +39,7 @@ class Info(Command):
         fields = [("Data path", stylize(dataPath, vc)),
                   ("Database Size", stylize("{:.3f} MB".format(dirSize/(1<<20)), vc)),
                   ("Number of entries", stylize(str(nworks), vc)),
+                  ("Search engine", stylize(db.textSearch.engine, vc)),
                   ("Tags", tagstr) ]
 
         w = max(len(x) for x,_ in fields)
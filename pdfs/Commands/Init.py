@@ -6,7 +6,8 @@ class Init(Command):
 
     def set_args(self, subparser):
         subparser.add_argument("--force", help="Overwrite existing document repository", action='store_true')
+        subparser.add_argument("--engine", help="Full text search engine (default: whoosh)", choices=["whoosh", "fts5"], default="whoosh")
 
     def run(self, args):
         from ..Database import Database
-        Database.init(dataDir=args.data_dir, clobber=args.force)
+        Database.init(dataDir=args.data_dir, clobber=args.force, engine=args.engine)
@@ -6,6 +6,8 @@ class List(Command):
     help = "List all items in database"
 
     def set_args(self, subparser):
+        subparser.add_argument("--query", "-q", metavar='QUERY', type=str, default=None,
+                               help="Indexed search, e.g. 'author:smith year:2015..2018 tag:review'")
         subparser.add_argument("--title", "-t", metavar='REGEX', type=str, default=None)
         subparser.add_argument("--author", "-a", metavar='REGEX', type=str, default=None).completer = authorCompleter
         subparser.add_argument("--year", "-y", metavar='REGEX', type=str, default=None)
@@ -17,9 +19,12 @@ class List(Command):
         from ..Database import Database
         from ..AnsiBib import printBibliography
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=bool(args.query))
 
-        gen = iter(db.works)
+        if args.query:
+            gen = (r['entry'] for r in db.search(args.query)[0])
+        else:
+            gen = iter(db.works)
 
         def match(g, f, r):
             if r:
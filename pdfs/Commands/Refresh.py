@@ -0,0 +1,36 @@
+from .Command import Command
+from .Completers import citekeyCompleter, tagCompleter
+
+class Refresh(Command):
+    command = 'refresh'
+    help = "Update metadata and bibtex of works from Crossref"
+
+    def set_args(self, subparser):
+        subparser.add_argument("keys", metavar='CITE_KEY', help="Works to refresh (default: all)", nargs='*', type=str).completer = citekeyCompleter
+        subparser.add_argument("--tag", "-T", metavar='TAG', help="Only refresh works with this tag", type=str, default=None).completer = tagCompleter
+        subparser.add_argument("--force", "-f", action="store_true",
+                               help="Fetch every work, not only those Crossref reports as updated since import")
+        subparser.add_argument("--include-edited", action="store_true",
+                               help="Regenerate bibtex even where it was edited by hand")
+
+    def run(self, args):
+        from ..Database import Database
+        from ..Exceptions import UserException
+        from ..Refresh import refreshWorks
+
+        db = Database(dataDir=args.data_dir, lazy=bool(args.keys))
+
+        if args.keys:
+            works = []
+            for k in args.keys:
+                e = db.find(key=k)
+                if not e:
+                    raise UserException("Key {} not found".format(k))
+                works.append(e)
+        else:
+            works = db.works
+
+        if args.tag:
+            works = [e for e in works if args.tag in e.tags]
+
+        refreshWorks(db, works, force=args.force, includeEdited=args.include_edited)
@@ -0,0 +1,100 @@
+from .Command import Command
+
+def _extract(db, works, procs):
+    from concurrent.futures import ProcessPoolExecutor
+    from ..ReadPdf import hasPdfTxt, storePdfTxt, scanPdf
+    from ..TermOutput import msg
+    import os
+
+    missing = []
+    for e in works:
+        fname = db.getFile(e)
+        md5 = e.md5s[e.fileLabels.index('PDF')]
+        if not hasPdfTxt(md5) and os.path.exists(fname):
+            missing.append((md5, fname))
+
+    if missing:
+        msg.info("Extracting text from %d PDFs using %d processes", len(missing), procs)
+        with ProcessPoolExecutor(procs) as pool:
+            for (md5, fname), (pages, err) in zip(missing, pool.map(scanPdf, [f for _, f in missing])):
+                if err:
+                    msg.warning("Could not read %s: %s", fname, err)
+                    continue
+                storePdfTxt(md5, pages)
+
+def _documents(db, works):
+    from ..ReadPdf import getPdfTxt, hasPdfTxt
+    from ..TermOutput import msg
+    import os
+
+    for e in works:
+        fname = db.getFile(e)
+        md5 = e.md5s[e.fileLabels.index('PDF')]
+        if hasPdfTxt(md5):
+            yield md5, getPdfTxt(fname, md5)
+        elif not os.path.exists(fname):
+            msg.warning("%s: %s is missing, not indexed", e.key(), fname)
+
+def _catchUp(db, snapshot):
+    from ..ReadPdf import getPdfTxt
+    from ..TextSearch import TextSearch
+
+    ts = TextSearch.open(db.dataDir)
+    n = 0
+    with ts.batch():
+        current = set()
+        for e in db.works:
+            md5, fields = e.md5s[0], db.searchFields(e)
+            current.add(md5)
+            if snapshot.get(md5) == fields:
+                continue
+            if md5 not in snapshot:
+                ts.delete(md5)
+                if 'PDF' in e.fileLabels:
+                    pdfMd5 = e.md5s[e.fileLabels.index('PDF')]
+                    ts.add(pdfMd5, getPdfTxt(db.getFile(e), pdfMd5))
+            ts.putMeta(md5, fields)
+            n += 1
+        for md5 in snapshot.keys() - current:
+            ts.delete(md5)
+            n += 1
+    return n
+
+class Reindex(Command):
+    command = 'reindex'
+    help = "Rebuild the full text index from the repository's PDFs"
+
+    def set_args(self, subparser):
+        subparser.add_argument("--jobs", "-j", help="Worker processes for text extraction and indexing", type=int, default=None)
+        subparser.add_argument("--engine", help="Move the index to this full text search engine", choices=["whoosh", "fts5"], default=None)
+
+    def run(self, args):
+        import os
+        import time
+        from ..Database import Database
+        from ..TermOutput import msg
+        from ..TextSearch import TextSearch
+
+        db = Database(dataDir=args.data_dir, lazy=True)
+        procs = args.jobs or len(os.sched_getaffinity(0))
+        works = [e for e in db.works if 'PDF' in e.fileLabels]
+
+        # The index is built from a snapshot without locking the repository,
+        # so other commands keep running. Works added, edited or deleted in
+        # the meantime are brought up to date under the lock afterwards.
+        snapshot = {e.md5s[0]: db.searchFields(e) for e in db.works}
+        t0 = time.time()
+        # Text is extracted before indexing starts, so the index is only
+        # locked while it is written.
+        _extract(db, works, procs)
+        nDocs, nPages = TextSearch.rebuild(db.dataDir, _documents(db, works), list(snapshot.items()), procs=procs, engine=args.engine)
+        dt = time.time() - t0
+
+        with db.transaction():
+            db.reload()
+            n = _catchUp(db, snapshot)
+        if n:
+            msg.info("Updated %d works changed during the rebuild", n)
+
+        msg("Indexed %d pages from %d of %d works in %.1f s (%.1f pages/s) with %s",
+            nPages, nDocs, len(works), dt, nPages/dt if dt else 0, TextSearch.engineOf(db.dataDir).engine)
@@ -1,20 +1,31 @@
+import argparse
+
 from .Command import Command
 
+def pageNumber(s):
+    page = int(s)
+    if page < 1:
+        raise argparse.ArgumentTypeError("pages are numbered from 1")
+    return page
+
 class Search(Command):
     command = 'search'
     help = "Search full text of PDF"
 
     def set_args(self, subparser):
         subparser.add_argument("query", nargs="+", type=str)
+        subparser.add_argument("--limit", "-n", help="Documents per page of results (0 for all)", type=int, default=10)
+        subparser.add_argument("--page", "-p", help="Page of results to show", type=pageNumber, default=1)
 
     def run(self, args):
         from ..AnsiBib import printWork
         from ..TermOutput import msg, fg, attr, stylize, printRule
         from ..Database import Database
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=True)
 
-        results = db.search(' '.join(args.query), formatter="ansi")
+        offset = args.limit * (args.page-1)
+        results, total = db.search(' '.join(args.query), formatter="ansi", limit=args.limit or None, offset=offset)
         for i,result in enumerate(results):
             printWork(result['entry'])
             msg("Score: " + stylize("{: 4.3f}".format(result['score']), fg("yellow"), attr('bold')))
@@ -25,3 +36,7 @@ class Search(Command):
 
             if i < len(results)-1:
                 printRule()
+
+        if total > len(results):
+            msg()
+            msg("Documents {}-{} of {}".format(offset+1 if results else offset, offset+len(results), total))
@@ -14,11 +14,10 @@ class View(Command):
         from ..Database import Database
         from ..Exceptions import UserException
 
-        db = Database(dataDir=args.data_dir)
+        db = Database(dataDir=args.data_dir, lazy=True)
 
-        try:
-            e = next(x for x in db.works if x.key() == args.key)
-        except StopIteration:
+        e = db.find(key=args.key)
+        if not e:
             raise UserException("Key {} not found".format(args.key))
 
         subprocess.Popen(['xdg-open', db.getFile(e, args.label)])
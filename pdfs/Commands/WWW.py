@@ -10,14 +10,15 @@ class WWW(Command):
         import logging
         import mimetypes
         import os
+        from urllib.parse import urlencode
 
         import flask
         import jinja2
 
         from ..Database import Database
-        from ..HTMLBib import bibContext, authorNorm
+        from ..HTMLBib import bibContext
+        from ..TextSearch import fieldQuery
         from ..Exceptions import UserException
-        from ..Bibtex import unicodeNorm
                 
         if not args.debug:
             logging.getLogger('werkzeug').setLevel(logging.ERROR)
@@ -35,18 +36,24 @@ class WWW(Command):
         def keySort(xs):
             return sorted(xs, key=lambda x: x.key())
 
-        def doSearch(tag=None, text=None, author=None, title=None):
-            db = Database(dataDir=args.data_dir)
+        perPage = 20
+
+        def doSearch(tag=None, text=None, author=None, title=None, page=1):
+            db = Database(dataDir=args.data_dir, lazy=bool(tag or text or author or title))
 
             ctx = dict(article_dir=os.path.basename(os.path.dirname(db.dataDir)), 
                        tags=mkTagList(db))
 
+            def indexed(q):
+                return keySort(r['entry'] for r in db.search(q)[0])
+
             if tag:
-                ctx['entries'] = bibContext(keySort(filter(lambda x: tag in x.tags, db.works)))
+                ctx['entries'] = bibContext(indexed(fieldQuery('tag', tag)))
                 ctx['search'] = "tag:" + tag
             elif text:
                 entries, searchData = [], []
-                for result in db.search(text, formatter="html"):
+                results, total = db.search(text, formatter="html", limit=perPage, offset=perPage*(page-1))
+                for result in results:
                     entries.append(result['entry'])
                     searchData.append(result)
 
@@ -57,24 +64,18 @@ class WWW(Command):
 
                 ctx['entries'] = bctx[::-1]
                 ctx['search'] = "text:" + text
-            elif author:
-                def isAuth(e):
-                    n, au, ed = set(), e.author(), e.editor()
-                    if au:
-                        n.update(authorNorm(x.split(', ')[0]) for x in au.split(' and '))
-                    if ed:
-                        n.update(authorNorm(x.split(', ')[0]) for x in ed.split(' and '))
-                    return author in n
-
-                matches = keySort(filter(isAuth, db.works))
 
-                ctx['entries'] = bibContext(matches)
+                pages = (total + perPage - 1) // perPage
+                if pages > 1:
+                    url = "/search?" + urlencode(dict(t="text", q=text))
+                    ctx['paging'] = dict(page=page, pages=pages, total=total,
+                                         prev=url + "&p={}".format(page-1) if page > 1 else None,
+                                         next=url + "&p={}".format(page+1) if page < pages else None)
+            elif author:
+                ctx['entries'] = bibContext(indexed(fieldQuery('author', author)))
                 ctx['search'] = "author:" + author
             elif title:
-                def m(x):
-                    return title.lower() in unicodeNorm(x.title()).lower()
-
-                ctx['entries'] = bibContext(keySort(filter(m, db.works)))
+                ctx['entries'] = bibContext(indexed(fieldQuery('title', title)))
                 ctx['search'] = "title:" + title
             else:
                 ctx['entries'] = bibContext(keySort(db.works))
@@ -91,7 +92,7 @@ class WWW(Command):
             queryType=flask.request.args.get('t', '')
 
             if queryType == "text":
-                ctx = doSearch(text=query)
+                ctx = doSearch(text=query, page=max(1, flask.request.args.get('p', 1, type=int)))
             elif queryType == "author":
                 ctx = doSearch(author=query)
             elif queryType == "title":
@@ -113,22 +114,22 @@ class WWW(Command):
 
         @flaskApp.route('/<key>.pdf')
         def getPdf(key):
-            db = Database(dataDir=args.data_dir)
-            try:
-                pdfFile = next(filter(lambda x: x.key() == key, db.works)).files[0]
-            except StopIteration:
+            db = Database(dataDir=args.data_dir, lazy=True)
+            e = db.find(key=key)
+            if not e:
                 raise KeyError
+            pdfFile = e.files[0]
             resp = flask.make_response(open(os.path.join(db.dataDir, pdfFile), "rb").read())
             resp.content_type = 'application/pdf'
             return resp
 
         @flaskApp.route('/attachment/<string:key>-<int:idx>.<string:ext>')
         def getAttached(key, idx, ext):
-            db = Database(dataDir=args.data_dir)
-            try:
-                attFile = next(filter(lambda x: x.key() == key, db.works)).files[idx]
-            except StopIteration:
+            db = Database(dataDir=args.data_dir, lazy=True)
+            e = db.find(key=key)
+            if not e:
                 raise KeyError
+            attFile = e.files[idx]
 
             filePath = os.path.join(db.dataDir, attFile)
             resp = flask.make_response(open(filePath, "rb").read())
@@ -138,7 +139,7 @@ class WWW(Command):
 
         @flaskApp.route('/<key>.bib')
         def getBib(key):
-            db = Database(dataDir=args.data_dir)
+            db = Database(dataDir=args.data_dir, lazy=True)
             e = db.find(key=key)
             resp = flask.make_response(e.bibtex)
             resp.content_type = 'text/plain'
@@ -42,7 +42,7 @@ class WatchDir(Command):
                         try:
                             newFile = filename.decode("utf-8")
                             newFilePath = os.path.join(wd, newFile)
-                            db = Database(dataDir=args.data_dir)
+                            db = Database(dataDir=args.data_dir, lazy=True)
                             e = db.find(pdfFname=newFilePath)
                             if e:
                                 raise WorkExistsException("new file {} exists in database as {}".format(newFile, e.key()))
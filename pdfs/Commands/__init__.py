@@ -1 +1 @@
-__all__ = ['Add', 'Aux2Bib', 'Bibtex', 'Edit', 'Import', 'Info', 'Init', 'List', 'Search', 'View', 'WatchDir', 'WWW']
+__all__ = ['Add', 'Aux2Bib', 'Bibtex', 'Cache', 'Edit', 'Import', 'Info', 'Init', 'List', 'Refresh', 'Reindex', 'Search', 'View', 'WatchDir', 'WWW']
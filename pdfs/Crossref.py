@@ -1,22 +1,206 @@
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 import requests
-import json
+import requests.adapters
 from .TermOutput import msg
-from .Cache import cachedRequest
+from .Cache import RequestCache, cachedRequest
+from .Exceptions import CrossrefException
 
-@cachedRequest("DOI")
+class RateLimiter:
+    _intervalRe = re.compile(r"([0-9.]+)\s*(ms|s|m)?")
+
+    def __init__(self, limit=10, interval=1.0):
+        self.cond = threading.Condition()
+        self.limit = limit
+        self.interval = interval
+        self.concurrency = limit
+        self.tokens = limit
+        self.stamp = time.monotonic()
+        self.inFlight = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now-self.stamp)*self.limit/self.interval)
+        self.stamp = now
+
+    def __enter__(self):
+        with self.cond:
+            while True:
+                self._refill()
+                if self.tokens >= 1 and self.inFlight < self.concurrency:
+                    self.tokens -= 1
+                    self.inFlight += 1
+                    return self
+                timeout = None
+                if self.tokens < 1:
+                    timeout = (1-self.tokens)*self.interval/self.limit
+                self.cond.wait(timeout)
+
+    def __exit__(self, *args):
+        with self.cond:
+            self.inFlight -= 1
+            self.cond.notify_all()
+
+    def update(self, headers):
+        with self.cond:
+            try:
+                if 'X-Rate-Limit-Limit' in headers:
+                    self.limit = max(1, int(headers['X-Rate-Limit-Limit']))
+                if 'X-Rate-Limit-Interval' in headers:
+                    n, unit = self._intervalRe.match(headers['X-Rate-Limit-Interval']).groups()
+                    self.interval = float(n) * {'ms': 1e-3, 'm': 60}.get(unit, 1)
+                self.concurrency = max(1, int(headers.get('X-Concurrency-Limit', self.limit)))
+            except (ValueError, AttributeError):
+                msg.debug("Ignoring bad Crossref rate limit headers: %s", dict(headers))
+            self.tokens = min(self.tokens, self.limit)
+            self.cond.notify_all()
+
+rateLimiter = RateLimiter()
+
+apiUrl = os.environ.get("PDFS_CROSSREF_URL", "https://api.crossref.org")
+mailto = os.environ.get("PDFS_MAILTO")
+timeout = (5, 30)
+maxRetries = 5
+backoff = 0.5
+# DOIs requested per /works?filter= call in crossrefLookupMany
+batchSize = 50
+batchThreads = 4
+
+_session = None
+_sessionLock = threading.Lock()
+
+def configure(*, url=None, contact=None):
+    global apiUrl, mailto, _session
+    with _sessionLock:
+        apiUrl = url or apiUrl
+        mailto = contact or mailto
+        _session = None
+
+def session():
+    global _session
+    with _sessionLock:
+        if _session is None:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=64)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            ua = "pdfs/0.1.0 (https://github.com/tmearnest/pdfs"
+            if mailto:
+                ua += "; mailto:" + mailto
+            s.headers['User-Agent'] = ua + ")"
+            _session = s
+        return _session
+
+def _retryDelay(attempt, response=None):
+    if response is not None and 'Retry-After' in response.headers:
+        try:
+            return float(response.headers['Retry-After'])
+        except ValueError:
+            pass
+    return backoff * 2**attempt * (1 + random.random()/2)
+
+def crossrefGet(path, **kwargs):
+    url = apiUrl + path
+    for attempt in range(maxRetries+1):
+        response = None
+        try:
+            with rateLimiter:
+                response = session().get(url, timeout=timeout, **kwargs)
+                rateLimiter.update(response.headers)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            err = "HTTP {}".format(response.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            err = "{}({})".format(type(e).__name__, e)
+
+        if attempt == maxRetries:
+            raise CrossrefException("Crossref request {} failed after {} attempts: {}".format(url, attempt+1, err))
+        delay = _retryDelay(attempt, response)
+        msg.debug("Crossref request %s failed (%s), retrying in %.1f s", url, err, delay)
+        time.sleep(delay)
+
+@cachedRequest("DOI", negative="NODOI")
 def crossrefLookup(doi):
-    url = "https://api.crossref.org/works/"+doi
-    response=None
-    decoded=None
+    r = crossrefGet("/works/" + quote(doi, safe="/()<>;:"))
+    if r.status_code == 404 or r.text == 'Resource not found.':
+        return None
+
+    try:
+        decoded = r.json()
+    except ValueError:
+        raise CrossrefException("Crossref returned malformed data for doi:{} (HTTP {})".format(doi, r.status_code))
 
+    if r.status_code != 200 or decoded.get('status') != 'ok':
+        raise CrossrefException("Crossref lookup for doi:{} failed (HTTP {}): {}".format(doi, r.status_code, decoded.get('message')))
+    return decoded['message']
+
+def _fetchMany(dois, since=None):
+    filters = ["doi:"+x for x in dois]
+    if since:
+        filters.append("from-update-date:" + since)
+    r = crossrefGet("/works", params={"filter": ",".join(filters), "rows": len(dois)})
     try:
-        response = requests.get(url).text
-        if response == 'Resource not found.':
-            return None
-        decoded = json.loads(response)
-        if decoded['status'] != 'ok':
-            raise RuntimeError("Crossref API call failed")
-        return decoded['message']
-    except:
-        msg("doi=%s\n\nresponse=%s\n\ndecoded=%s\n\n",doi,response,decoded)
-        raise
+        decoded = r.json()
+    except ValueError:
+        decoded = {}
+
+    if r.status_code != 200 or decoded.get('status') != 'ok':
+        msg.debug("Batch lookup of %d DOIs failed (HTTP %d)", len(dois), r.status_code)
+        return None
+
+    byDoi = {x['DOI'].lower(): x for x in decoded['message']['items']}
+    return {doi: byDoi[doi.lower()] for doi in dois if doi.lower() in byDoi}
+
+def _fetchBatches(jobs):
+    with ThreadPoolExecutor(batchThreads) as pool:
+        yield from zip((c for c, _ in jobs), pool.map(lambda x: _fetchMany(*x), jobs))
+
+def crossrefLookupMany(dois, refresh=False):
+    dois = list(dict.fromkeys(dois))
+    stale = [x for x in dois if refresh or not crossrefLookup.cached(x)]
+    found = {}
+
+    todo = [x for x in stale if ',' not in x]
+    for chunk, metas in _fetchBatches([(todo[i:i+batchSize], None) for i in range(0, len(todo), batchSize)]):
+        if metas is None:
+            continue
+        with RequestCache().batch():
+            for doi in chunk:
+                found[doi] = metas.get(doi)
+                crossrefLookup.prime(doi, found[doi])
+        msg.debug("Batch lookup: %d of %d DOIs found", len(metas), len(chunk))
+
+    for doi in dois:
+        if doi not in found:
+            if refresh and doi in stale:
+                crossrefLookup.forget(doi)
+            found[doi] = crossrefLookup(doi)
+    return found
+
+def crossrefUpdates(since):
+    # `since` maps DOIs to the YYYY-MM-DD date their stored metadata was
+    # deposited, or None. Only works updated after that date come back.
+    # Sorting by date keeps each batch's from-update-date filter tight.
+    dois = sorted((x for x in since if ',' not in x), key=lambda x: since[x] or '')
+    chunks = [dois[i:i+batchSize] for i in range(0, len(dois), batchSize)]
+    updated = {}
+    for chunk, metas in _fetchBatches([(c, since[c[0]]) for c in chunks]):
+        if metas is None:
+            raise CrossrefException("Crossref rejected a batch lookup of {} DOIs".format(len(chunk)))
+        with RequestCache().batch():
+            for doi, meta in metas.items():
+                crossrefLookup.prime(doi, meta)
+        updated.update(metas)
+
+    for doi in since:
+        if ',' in doi:
+            crossrefLookup.forget(doi)
+            meta = crossrefLookup(doi)
+            if meta:
+                updated[doi] = meta
+    return updated
@@ -0,0 +1,222 @@
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, unquote
+
+from .TermOutput import msg
+
+# Offline stand-in for the parts of api.crossref.org that pdfs uses:
+# /works/DOI and /works?filter=doi:...,from-update-date:... Point pdfs at it
+# with PDFS_CROSSREF_URL=http://127.0.0.1:PORT.
+#
+# Fixture records live in data/crossref-fixtures.json, one per work type.
+# Any DOI of the form 10.5555/stub.TYPE.N is answered with a copy of the
+# TYPE fixture renumbered to N, so corpora of any size can be requested.
+
+fixtureFile = os.path.join(os.path.dirname(__file__), "data", "crossref-fixtures.json")
+
+_syntheticRe = re.compile(r'10\.5555/stub\.([a-z-]+)\.([0-9]+)$')
+
+def loadFixtures(fname=None):
+    return {k.lower(): v for k, v in json.load(open(fname or fixtureFile)).items()}
+
+def _synthesize(template, doi, n):
+    meta = copy.deepcopy(template)
+    rng = random.Random(doi)
+    meta['DOI'] = doi
+    meta['URL'] = "http://dx.doi.org/" + doi
+    meta['title'][-1] = "{} {}".format(meta['title'][-1], n)
+    for p in meta.get('author', []):
+        p['family'] = "{}{}".format(p['family'], rng.choice("bcdfghklmnprstvz"))
+    date = meta['issued']['date-parts'][0]
+    date[0] = 1990 + n % 30
+    return meta
+
+# http.server.ThreadingHTTPServer is only in Python 3.7+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class StubState:
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, rate429=0.0, rate5xx=0.0, rateTimeout=0.0, hang=60.0,
+                 limit=50, interval="1s", concurrency=None):
+        self.fixtures = fixtures
+        self.byType = {}
+        for meta in fixtures.values():
+            self.byType.setdefault(meta['type'], meta)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate429 = rate429
+        self.rate5xx = rate5xx
+        self.rateTimeout = rateTimeout
+        self.hang = hang
+        self.headers = {"X-Rate-Limit-Limit": str(limit), "X-Rate-Limit-Interval": interval}
+        if concurrency:
+            self.headers["X-Concurrency-Limit"] = str(concurrency)
+        self.lock = threading.Lock()
+        self.counts = dict(requests=0, works=0, notFound=0, injected429=0, injected5xx=0, injectedTimeouts=0)
+
+    def count(self, k, n=1):
+        with self.lock:
+            self.counts[k] += n
+
+    def lookup(self, doi):
+        doi = doi.lower()
+        if doi in self.fixtures:
+            return self.fixtures[doi]
+        m = _syntheticRe.match(doi)
+        if m and m.group(1) in self.byType:
+            return _synthesize(self.byType[m.group(1)], doi, int(m.group(2)))
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "CrossrefStub/0.1"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        msg.debug("%s " + fmt, self.address_string(), *args)
+
+    def _send(self, status, body, contentType="application/json", headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in list(self.server.state.headers.items()) + list(headers):
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject(self):
+        st = self.server.state
+        if st.latency or st.jitter:
+            time.sleep(max(0, random.gauss(st.latency, st.jitter)))
+
+        r = random.random()
+        if r < st.rateTimeout:
+            st.count('injectedTimeouts')
+            time.sleep(st.hang)
+            self.close_connection = True
+            return True
+        r -= st.rateTimeout
+        if r < st.rate429:
+            st.count('injected429')
+            self._send(429, b"Too Many Requests", "text/plain", [("Retry-After", "1")])
+            return True
+        r -= st.rate429
+        if r < st.rate5xx:
+            st.count('injected5xx')
+            self._send(503, b"Service Unavailable", "text/plain")
+            return True
+        return False
+
+    def do_GET(self):
+        st = self.server.state
+        st.count('requests')
+        if self._inject():
+            return
+
+        url = urlparse(self.path)
+        if url.path.startswith("/works/"):
+            meta = st.lookup(unquote(url.path[len("/works/"):]))
+            if meta is None:
+                st.count('notFound')
+                self._send(404, b"Resource not found.", "text/plain")
+            else:
+                st.count('works')
+                self._send(200, {"status": "ok", "message-type": "work", "message-version": "1.0.0", "message": meta})
+        elif url.path == "/works":
+            self._filter(parse_qs(url.query))
+        else:
+            self._send(404, b"Resource not found.", "text/plain")
+
+    def _filter(self, query):
+        st = self.server.state
+        dois, since = [], None
+        for f in ",".join(query.get("filter", [])).split(","):
+            name, _, value = f.partition(":")
+            if name == "doi":
+                dois.append(value)
+            elif name == "from-update-date":
+                since = value
+            elif name:
+                self._send(400, {"status": "failed", "message-type": "validation-failure",
+                                 "message": [{"type": "filter-not-available", "value": name}]})
+                return
+
+        items = [x for x in map(st.lookup, dois) if x]
+        if since:
+            items = [x for x in items if x['deposited']['date-time'][:10] >= since]
+        items = items[:int(query.get("rows", ["20"])[0])]
+        st.count('works', len(items))
+        st.count('notFound', len(dois) - len(items))
+        self._send(200, {"status": "ok", "message-type": "work-list", "message-version": "1.0.0",
+                         "message": {"facets": {}, "total-results": len(items), "items": items,
+                                     "items-per-page": len(items), "query": {"start-index": 0, "search-terms": None}}})
+
+def record(dois, fname):
+    from .Crossref import crossrefGet, apiUrl
+
+    fixtures = json.load(open(fname)) if os.path.exists(fname) else {}
+    for doi in dois:
+        r = crossrefGet("/works/" + doi)
+        if r.status_code != 200:
+            msg.warning("doi:%s not recorded (HTTP %d from %s)", doi, r.status_code, apiUrl)
+            continue
+        meta = r.json()['message']
+        fixtures[meta['DOI']] = meta
+        msg.info("Recorded doi:%s (%s)", meta['DOI'], meta['type'])
+    json.dump(fixtures, open(fname, "w"), indent=1, sort_keys=True)
+
+def serve(state, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Crossref stand-in for testing and benchmarking pdfs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", "-p", type=int, default=8765)
+    parser.add_argument("--fixtures", help="Fixture JSON (DOI to Crossref message)", default=fixtureFile)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Standard deviation of the added latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="Fraction of requests left hanging")
+    parser.add_argument("--hang", type=float, default=60.0, help="How long a hanging request stalls, seconds")
+    parser.add_argument("--limit", type=int, default=50, help="Advertised X-Rate-Limit-Limit")
+    parser.add_argument("--interval", default="1s", help="Advertised X-Rate-Limit-Interval")
+    parser.add_argument("--concurrency", type=int, default=None, help="Advertised X-Concurrency-Limit")
+    parser.add_argument("--record", nargs="+", metavar="DOI",
+                        help="Fetch these DOIs from $PDFS_CROSSREF_URL (default: the live API) into the fixture file and exit")
+    parser.add_argument("--logging-level", "-L", metavar="LEVEL", type=str, default="INFO")
+    args = parser.parse_args()
+
+    msg.setup(level=args.logging_level)
+    if args.record:
+        record(args.record, args.fixtures)
+        return
+
+    state = StubState(loadFixtures(args.fixtures), latency=args.latency, jitter=args.jitter,
+                      rate429=args.rate_429, rate5xx=args.rate_5xx, rateTimeout=args.rate_timeout, hang=args.hang,
+                      limit=args.limit, interval=args.interval, concurrency=args.concurrency)
+    server = serve(state, args.host, args.port)
+    msg.info("Serving %d fixtures (types: %s) on http://%s:%d", len(state.fixtures),
+             ", ".join(sorted(state.byType)), *server.server_address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        msg.info("Request counts: %s", ", ".join("{}={}".format(k, v) for k, v in state.counts.items()))
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,19 @@
-import json
 import shutil
 import os
 import os.path
 import re
-import time
 import unicodedata
+from contextlib import contextmanager
+from functools import partial
 
 from .TermOutput import msg
+from .FileLock import FileLock
+from .MetaStore import MetaStore, schemaVersion
 from .Exceptions import WorkExistsException, UserException, RepositoryException
-from .BaseWork import Work
+from .BaseWork import Work, trimMeta
 from .WorkTypes import *
-from .TextSearch import TextSearch
-from .ReadPdf import getPdfTxt, md5sum
+from .TextSearch import TextSearch, defaultEngine
+from .ReadPdf import getPdfTxt, dropPdfTxt, md5sum
 from .HTMLBib import authorNorm
 
 def _nameDbFile(entry, fname, idx):
@@ -36,24 +38,9 @@ def _nameDbFile(entry, fname, idx):
     return dbFname
 
 
-class FileLock:
-    def __init__(self, lockFname):
-        self.lockFname = lockFname
-    def __enter__(self):
-        if os.path.exists(self.lockFname):
-            otherPid = int(open(self.lockFname).read())
-            msg.warning("Waiting for lock on document repository (pid %d has it)", otherPid)
-            while os.path.exists(self.lockFname):
-                time.sleep(0.2)
-        with open(self.lockFname, "w") as f:
-            print(os.getpid(), file=f)
-    def __exit__(self, *args):
-        os.unlink(self.lockFname)
-
-
 class Database:
     @classmethod
-    def init(cls, dataDir=None, clobber=False):
+    def init(cls, dataDir=None, clobber=False, engine=defaultEngine):
         dataDir = dataDir or os.path.join(os.path.abspath('.'), 'articles')
         try:
             os.mkdir(dataDir)
@@ -64,29 +51,56 @@ class Database:
                 msg.warning("Clobbered %s", dataDir)
             else:
                 raise FileExistsError("Document repository already exists at "+dataDir)
-        json.dump([], open(os.path.join(dataDir, ".metadata.json"), "w"))
-        TextSearch.init(dataDir)
+        MetaStore(os.path.join(dataDir, ".metadata.db")).close()
+        TextSearch.init(dataDir, engine)
         return cls(dataDir=dataDir)
             
-    def find(self, *, pdfFname=None, key=None):
+    def find(self, *, pdfFname=None, key=None, md5=None, doi=None):
         if pdfFname:
-            pdfMd5 = md5sum(pdfFname)
-            try:
-                return next(x for x in self.works if pdfMd5 in x.md5s)
-            except StopIteration:
-                return
-        if key:
-            try:
-                return next(x for x in self.works if key == x.key())
-            except StopIteration:
-                return
+            md5 = md5sum(pdfFname)
+        if md5:
+            idx, k = self._byMd5, md5
+        elif key:
+            idx, k = self._byKey, key
+        elif doi:
+            idx, k = self._byDoi, doi.lower()
+        else:
+            return
+
+        if k in idx or self._works is not None:
+            return idx.get(k)
+
+        d = self.store.findRecord(md5=md5, key=key, doi=doi)
+        if d:
+            w = self._fromRecord(d)
+            self._index(w)
+            return w
+
+    def _fromRecord(self, d):
+        loadRaw = partial(self.store.loadRaw, d['md5s'][0])
+        if 'meta' in d:
+            return Work.from_db(loadRaw=loadRaw, **d)
+        return Work.from_db(loadMeta=partial(self.store.loadMeta, d['md5s'][0]), loadRaw=loadRaw, **d)
+
+    def _index(self, work):
+        self._byKey.setdefault(work.key(), work)
+        for md5 in work.md5s:
+            self._byMd5.setdefault(md5, work)
+        doi = work.doi()
+        if doi:
+            self._byDoi.setdefault(doi.lower(), work)
+
+    def _unindex(self, work):
+        for idx, k in [(self._byKey, work.key()), (self._byDoi, (work.doi() or '').lower())] + [(self._byMd5, x) for x in work.md5s]:
+            if idx.get(k) is work:
+                del idx[k]
 
     @staticmethod
     def getDataDir(*, dataDir=None):
         if not dataDir:
             lastDir, root = '', os.path.abspath('.')
             while lastDir != root:
-                if os.path.exists(os.path.join(root, "articles/.metadata.json")):
+                if any(os.path.exists(os.path.join(root, "articles", x)) for x in (".metadata.db", ".metadata.json")):
                     dataDir = os.path.join(root, "articles")
                     break
                 else:
@@ -94,26 +108,120 @@ class Database:
                     root = os.path.abspath(os.path.join(root, ".."))
         return dataDir
 
-    def __init__(self, *, dataDir=None):
-        self.works = None
+    def __init__(self, *, dataDir=None, lazy=False):
         dataDir = self.getDataDir(dataDir=dataDir)
         if not dataDir:
             raise RepositoryException("Could not find a document repository here (or any parent up to /)")
         self.dataDir = dataDir
-        self.metaFile= os.path.join(dataDir, ".metadata.json")
+        self.metaFile= os.path.join(dataDir, ".metadata.db")
         self.metaLockFile = os.path.join(dataDir, ".metadata.lck")
-        with FileLock(self.metaLockFile):
-            self.works = [Work.from_db(**d) for d in json.load(open(os.path.join(dataDir, ".metadata.json")))]
+        legacyFile = os.path.join(dataDir, ".metadata.json")
+        if not os.path.exists(self.metaFile) and os.path.exists(legacyFile):
+            with FileLock(self.metaLockFile):
+                if not os.path.exists(self.metaFile):
+                    self._migrateJson(legacyFile)
+        self.store = MetaStore(self.metaFile)
+        if self.store.version < schemaVersion:
+            with FileLock(self.metaLockFile):
+                if self.store.version < schemaVersion:
+                    n = self.store.splitRaw(trimMeta)
+                    msg.info("Moved full Crossref metadata of %d entries to compressed storage", n)
+
+        self.lazy = lazy
+        self._inTransaction = False
+        self._works = None
+        self._byKey, self._byMd5, self._byDoi = {}, {}, {}
+        if not lazy:
+            self._loadWorks()
+
+        self._textSearch = None
+
+    def _migrateJson(self, legacyFile):
+        tmpFile = self.metaFile + ".tmp"
+        if os.path.exists(tmpFile):
+            os.unlink(tmpFile)
+        store = MetaStore(tmpFile)
+        n = store.migrateJson(legacyFile, trimMeta)
+        store.close()
+        os.rename(tmpFile, self.metaFile)
+        os.rename(legacyFile, legacyFile + ".bak")
+        msg.info("Migrated %d entries from %s to %s", n, legacyFile, self.metaFile)
+
+    def _loadWorks(self):
+        if self._inTransaction:
+            records = self.store.records(withMeta=not self.lazy)
+        else:
+            with FileLock(self.metaLockFile, shared=True):
+                records = self.store.records(withMeta=not self.lazy)
+        works = []
+        for d in records:
+            w = self._byMd5.get(d['md5s'][0]) or self._fromRecord(d)
+            self._index(w)
+            works.append(w)
+        self._works = works
 
-        self.textSearch = TextSearch(self.dataDir)
+    @property
+    def works(self):
+        if self._works is None:
+            self._loadWorks()
+        return self._works
+
+    def reload(self):
+        # Forgets the loaded works, so changes by other processes are seen
+        self._works = None
+        self._byKey, self._byMd5, self._byDoi = {}, {}, {}
+
+    @property
+    def textSearch(self):
+        if self._textSearch is None:
+            ts = TextSearch.open(self.dataDir)
+            if not ts.fielded:
+                with self.transaction():
+                    n = ts.addFields((w.md5s[0], self.searchFields(w)) for w in self.works)
+                if n:
+                    msg.info("Added metadata of %d entries to the full text index", n)
+            self._textSearch = ts
+        return self._textSearch
 
-        self.tags = set()
-        for w in self.works:
-            self.tags.update(w.tags)
+    @staticmethod
+    def searchFields(work):
+        fields = dict(key=work.key(), tag=','.join(work.tags))
+        for k, v in [('title', work.title() or work.booktitle()),
+                     ('author', ' and '.join(filter(None, [work.author(), work.editor()]))),
+                     ('journal', work.journal() or work.booktitle()),
+                     ('year', work.year()),
+                     ('doi', work.doi())]:
+            if v:
+                fields[k] = v
+        return fields
+
+    @property
+    def tags(self):
+        return set(self.store.tags())
+
+    @contextmanager
+    def transaction(self):
+        if self._inTransaction:
+            yield
+            return
 
-    def save(self):
         with FileLock(self.metaLockFile):
-            json.dump([x.toDict() for x in self.works], open(os.path.join(self.dataDir, ".metadata.json"), "w"), indent=1, sort_keys=True)
+            self._inTransaction = True
+            try:
+                yield
+            except BaseException:
+                self.store.rollback()
+                raise
+            else:
+                self.store.commit()
+            finally:
+                self._inTransaction = False
+
+    def save(self, *works):
+        with self.transaction(), self.textSearch.batch():
+            for w in works or self.works:
+                self.store.putWork(w.toDict())
+                self.textSearch.putMeta(w.md5s[0], self.searchFields(w))
 
     def attach(self, key, filename):
         e = self.find(key=key)
@@ -134,7 +242,8 @@ class Database:
         e.md5s.append(md5)
         e.fileLabels.append(name)
         e.files.append(siFileName)
-        self.save()
+        self._byMd5.setdefault(md5, e)
+        self.save(e)
 
     def removeAttachment(self, key, name):
         e = self.find(key=key)
@@ -147,18 +256,24 @@ class Database:
             raise UserException("Attachment {} not found.".format(name))
 
         os.unlink(os.path.join(self.dataDir, e.fileLabels[i]))
+        if self._byMd5.get(e.md5s[i]) is e:
+            del self._byMd5[e.md5s[i]]
         del e.md5s[i]
         del e.fileLabels[i]
         del e.files[i]
-        self.save()
+        self.save(e)
 
     def add(self, entry, pdfFname, suppFnames, tags):
         # Check for existing pdf
         pdfMd5 = md5sum(pdfFname)
-        otherWork = self.find(pdfFname=pdfFname)
+        otherWork = self.find(md5=pdfMd5)
         if otherWork:
             raise WorkExistsException("{} already exists in database with key {}".format(os.path.basename(pdfFname), otherWork.key()))
 
+        otherWork = self.find(doi=entry.doi())
+        if otherWork:
+            msg.warning("doi:%s is already in the database with key %s", entry.doi(), otherWork.key())
+
         # copy files
         newPdfFname =  _nameDbFile(entry, pdfFname, 0)
         shutil.copyfile(pdfFname, os.path.join(self.dataDir, newPdfFname))
@@ -177,12 +292,11 @@ class Database:
             entry.fileLabels.append(os.path.basename(fn))
 
         # ensure unique cite key 
-        citeKeys = self.citeKeys
         oldKey = entry.key()
         newKey = oldKey
         suffix = 'a'
 
-        while newKey in citeKeys:
+        while self.find(key=newKey):
             newKey = oldKey + suffix
             suffix = chr(ord(suffix)+1)
 
@@ -190,10 +304,23 @@ class Database:
 
         for t in tags:
             entry.tags.append(t)
-        self.tags.update(tags)
 
-        self.works.append(entry)
-        self.save()
+        if self._works is not None:
+            self._works.append(entry)
+        self._index(entry)
+        self.save(entry)
+
+    @property
+    def reviewQueue(self):
+        return self.store.reviewQueue()
+
+    def queueReview(self, path, reason, dois=()):
+        with self.transaction():
+            self.store.putReview(os.path.abspath(path), reason, list(dois))
+
+    def dequeueReview(self, path):
+        with self.transaction():
+            self.store.deleteReview(os.path.abspath(path))
 
     def getFile(self, entryThing, name='PDF'):
         if isinstance(entryThing, str):
@@ -204,20 +331,28 @@ class Database:
         fname = entry.files[i]
         return os.path.join(self.dataDir, fname)
 
+    def setKey(self, entry, newKey):
+        self._unindex(entry)
+        entry.set_key(newKey)
+        self._index(entry)
+
     def delete(self, key):
         oldEntry = self.find(key=key)
-        newWorks = [w for w in self.works if w is not oldEntry]
-        if len(newWorks) == len(self.works):
+        if not oldEntry:
             raise UserException("Key {} not in repository".format(key))
 
         self.textSearch.delete(oldEntry.md5s[0])
+        dropPdfTxt(oldEntry.md5s[0])
         
-        self.works = newWorks
-        self.save()
+        if self._works is not None:
+            self._works = [w for w in self._works if w is not oldEntry]
+        self._unindex(oldEntry)
+        with self.transaction():
+            self.store.deleteWork(oldEntry.md5s[0])
 
     def copyFromDb(self, dbSrc, key):
         eSrc = dbSrc.find(key=key)
-        eDst = Work.from_db(**eSrc.toDict())
+        eDst = Work.from_db(**dict(eSrc.toDict(), rawMeta=eSrc.rawMeta))
 
         for lbl in eDst.fileLabels:
             srcFile = dbSrc.getFile(eSrc, lbl)
@@ -226,21 +361,32 @@ class Database:
 
         self.textSearch.add(eDst.md5s[0], getPdfTxt(self.getFile(eDst, "PDF")))
 
-        self.works.append(eDst)
-        self.tags.update(eDst.tags)
-        self.save()
+        if self._works is not None:
+            self._works.append(eDst)
+        self._index(eDst)
+        self.save(eDst)
         return eDst
 
-    def search(self, query, formatter=None):
+    def replace(self, old, new):
+        if self._works is not None:
+            self._works = [new if w is old else w for w in self._works]
+        self._unindex(old)
+        self._index(new)
+        self.save(new)
+
+    def search(self, query, formatter=None, limit=None, offset=0):
         results = []
-        for md5, score, frags in self.textSearch.search(query, formatter):
-            entry = next(filter(lambda x, md5=md5: x.md5s[0] == md5, self.works))
+        hits, total = self.textSearch.search(query, formatter, limit, offset)
+        for md5, score, frags in hits:
+            entry = self.find(md5=md5)
             results.append( dict(entry=entry, score=score, frags=frags) )
-        return results
+        return results, total
 
     @property
     def citeKeys(self):
-        return [x.key() for x in self.works]
+        if self._works is None:
+            return self.store.citeKeys()
+        return list(self._byKey)
 
 
     @property
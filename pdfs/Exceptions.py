@@ -9,3 +9,6 @@ class UserException(Exception):
 
 class RepositoryException(Exception):
     pass
+
+class CrossrefException(Exception):
+    pass
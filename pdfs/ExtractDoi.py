@@ -1,45 +1,138 @@
 import re
 import os
+import mmap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .Exceptions import AbortException
 from .Prompt import promptOptions, promptString
 from .TermOutput import msg
 from .BaseWork import Work
 from .AnsiBib import printBibliography, printWork
-from .ReadPdf import getPdfTxt
+from .ReadPdf import getPdfTxt, firstPagesTxt, pdfMetadataTxt
 
 _doiRegexStr= re.compile(r'10[.][0-9]{4,}[^\s"/<>]*/[^\s"<>]+')
+_doiRegexBytes = re.compile(rb'10[.][0-9]{4,}[^\s"/<>()\[\]{}\x00-\x1f\x7f-\xff]*/[^\s"<>()\[\]{}\x00-\x1f\x7f-\xff]+')
 
-def _chopPeriod(x):
-    if x[-1] == '.':
-        return x[:-1]
+# Number of leading pages searched before falling back to the full text
+firstPages = 2
+
+# Candidate DOIs looked up concurrently while prompting
+lookupThreads = 8
+
+_doiSyntax = re.compile(r'10[.][0-9]{4,9}(?:[.][0-9]+)*/\S*[0-9a-z)]$')
+_isbnPrefix = re.compile(r'/(97[89](?:-?[0-9]){10})(?![0-9])')
+_issnPrefix = re.compile(r'/s?([0-9]{4})-?([0-9]{3}[0-9x])[(]')
+
+def _trimDoi(x):
+    x = x.rstrip(".,;:")
+    for o, c in ["()", "[]"]:
+        while x.endswith(c) and x.count(c) > x.count(o):
+            x = x[:-1].rstrip(".,;:")
     return x
 
+def _isbnOk(digits):
+    return sum(int(d)*(1 if i%2 == 0 else 3) for i, d in enumerate(digits)) % 10 == 0
+
+def _issnOk(digits):
+    check = (11 - sum(int(d)*(8-i) for i, d in enumerate(digits[:7])) % 11) % 11
+    return digits[7] == ('x' if check == 10 else str(check))
+
+def plausibleDoi(doi):
+    if len(doi) > 200 or not _doiSyntax.match(doi):
+        return False
+    m = _isbnPrefix.search(doi)
+    if m and not _isbnOk(m.group(1).replace('-', '')):
+        return False
+    m = _issnPrefix.search(doi)
+    if m and not _issnOk(''.join(m.groups())):
+        return False
+    return True
+
 def extractDois(fname):
-    pdfData = '\n'.join(getPdfTxt(fname))
-    dois = [_chopPeriod(x.lower()) for x in _doiRegexStr.findall(pdfData)]
+    return doisFromPages(getPdfTxt(fname))
+
+def doisFromPages(pages):
+    return _doisFromTxt('\n'.join(pages))
+
+def _doisFromTxt(txt):
+    dois = [_trimDoi(x.lower()) for x in _doiRegexStr.findall(txt)]
+    seen = set()
+    dois = [x for x in dois if not (x in seen or seen.add(x))]
+    bad = {x for x in dois if not plausibleDoi(x)}
+    if bad:
+        msg.debug("Skipping malformed DOI candidates: %s", ", ".join(sorted(bad)))
+    return [x for x in dois if x not in bad]
+
+def _doisFromMetadata(fname):
+    try:
+        return _doisFromTxt(pdfMetadataTxt(fname))
+    except Exception as e:
+        msg.debug("Could not read PDF metadata from %s: %s", fname, e)
+        return []
+
+def _doisFromRawBytes(fname):
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _doisFromTxt('\n'.join(x.decode('ascii') for x in _doiRegexBytes.findall(m)))
+
+def doiCandidates(fname, pages=None):
+    # pages, when the text is already at hand, saves extracting it again
+    stages = [("PDF metadata", _doisFromMetadata),
+              ("raw PDF data", _doisFromRawBytes),
+              ("first pages", lambda f: doisFromPages(pages[:firstPages] if pages is not None else firstPagesTxt(f, firstPages))),
+              ("full text", lambda f: doisFromPages(pages) if pages is not None else extractDois(f))]
+
     seen = set()
-    return [x for x in dois if not (x in seen or seen.add(x))]
+    for name, stage in stages:
+        dois = [x for x in stage(fname) if x not in seen]
+        seen.update(dois)
+        msg.debug("%d new DOI candidates from %s", len(dois), name)
+        yield dois
+
+def _lookup(doi):
+    try:
+        return Work.from_doi(doi)
+    except ValueError:
+        return None
+
+def resolveDois(dois, pool, window=None):
+    dois = iter(dois)
+    pending = deque(pool.submit(_lookup, doi) for _, doi in zip(range(window or lookupThreads), dois))
+    try:
+        while pending:
+            e = pending.popleft().result()
+            doi = next(dois, None)
+            if doi:
+                pending.append(pool.submit(_lookup, doi))
+            if e:
+                yield e
+    finally:
+        # Lookups still queued when the caller stops early are dropped
+        for f in pending:
+            f.cancel()
 
 def entryFromPdf(fname):
-    dois = extractDois(fname)
+    dois = []
     maxChoices = 5
 
     def chunker():
-        lst = []
-        for doi in dois:
-            try:
-                e = Work.from_doi(doi)
-                if e:
-                    lst.append(e)
-            except ValueError:
-                pass
-            
-            if len(lst)==maxChoices:
-                yield lst
+        pool = ThreadPoolExecutor(lookupThreads)
+        try:
+            for stage in doiCandidates(fname):
+                dois.extend(stage)
                 lst = []
-        if lst:
-            yield lst
-            
+                for e in resolveDois(stage, pool):
+                    lst.append(e)
+                    if len(lst)==maxChoices:
+                        yield lst
+                        lst = []
+                if lst:
+                    yield lst
+        finally:
+            pool.shutdown(wait=False)
+
     showMsg = True
     for chunkId, bibChunk in enumerate(chunker()):
         if len(bibChunk) == 1 and chunkId == 0:
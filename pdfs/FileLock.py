@@ -0,0 +1,42 @@
+import fcntl
+import os
+
+from .TermOutput import msg
+
+class FileLock:
+    def __init__(self, lockFname, shared=False, what="document repository"):
+        self.lockFname = lockFname
+        self.shared = shared
+        self.what = what
+        self.fd = None
+
+    def _holder(self):
+        try:
+            pid = int(open(self.lockFname).read())
+            os.kill(pid, 0)
+            return "pid {} has it".format(pid)
+        except (ValueError, FileNotFoundError, ProcessLookupError):
+            return "held by readers"
+
+    def __enter__(self):
+        # flock() locks belong to the open file, so the kernel drops them when
+        # the holder exits, crashed or not. The pid written here is only for
+        # the waiting message.
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        self.fd = os.open(self.lockFname, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            msg.warning("Waiting for lock on %s (%s)", self.what, self._holder())
+            fcntl.flock(self.fd, mode)
+        if not self.shared:
+            os.ftruncate(self.fd, 0)
+            os.write(self.fd, "{}\n".format(os.getpid()).encode())
+        return self
+
+    def __exit__(self, *args):
+        if not self.shared:
+            os.ftruncate(self.fd, 0)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
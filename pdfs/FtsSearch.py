@@ -0,0 +1,412 @@
+import html
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .Exceptions import UserException
+from .FileLock import FileLock
+from .TermOutput import wrapWithColor, fg, attr, stylize
+from .TextSearch import TextSearch, metaFields, mixedQueryError
+
+_tokenizer = "porter unicode61 remove_diacritics 2"
+
+# docs gives every work a stable rowid, used for its row in works, and
+# remembers the rowid range of its pages so deletes never scan pages.
+_tables = ["""CREATE TABLE IF NOT EXISTS docs (
+                  md5   TEXT PRIMARY KEY,
+                  first INTEGER,
+                  pages INTEGER NOT NULL DEFAULT 0)""",
+           "CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(md5 UNINDEXED, page UNINDEXED, text, tokenize='{}')".format(_tokenizer),
+           "CREATE VIRTUAL TABLE IF NOT EXISTS works USING fts5(md5 UNINDEXED, year UNINDEXED, title, author, journal, tokenize='{}')".format(_tokenizer),
+           # key, doi and tag only match whole values, as Whoosh's KEYWORD
+           # fields do, so they are kept out of the stemmed works table.
+           """CREATE TABLE IF NOT EXISTS keywords (
+                  md5   TEXT NOT NULL,
+                  field TEXT NOT NULL,
+                  term  TEXT NOT NULL)""",
+           "CREATE INDEX IF NOT EXISTS keywordsTerm ON keywords (field, term)",
+           "CREATE INDEX IF NOT EXISTS keywordsMd5 ON keywords (md5)"]
+
+_workCols = ('year', 'title', 'author', 'journal')
+_keywordCols = ('key', 'doi', 'tag')
+
+_tokenRe = re.compile(r'\w+:\([^()]*\)|\(|\)|(?:\w+:)?(?:"[^"]*"|\[[^\]]*\]|[^\s()"]+)')
+_fieldRe = re.compile(r'(\w+):(.+)$', re.S)
+_groupRe = re.compile(r'"[^"]*"|[^\s"]+')
+_operators = {'AND': 'AND', 'OR': 'OR', 'NOT': 'NOT', 'ANDNOT': 'NOT'}
+_matchRe = re.compile('\x02(.*?)\x03', re.S)
+
+def _docId(conn, md5):
+    conn.execute("INSERT OR IGNORE INTO docs (md5) VALUES (?)", (md5,))
+    return conn.execute("SELECT rowid, first, pages FROM docs WHERE md5=?", (md5,)).fetchone()
+
+def _addPages(conn, md5, pages):
+    docId, first, n = _docId(conn, md5)
+    if n:
+        conn.execute("DELETE FROM pages WHERE rowid BETWEEN ? AND ?", (first, first+n-1))
+    row = conn.execute("SELECT rowid FROM pages ORDER BY rowid DESC LIMIT 1").fetchone()
+    first = row[0]+1 if row else 1
+    conn.executemany("INSERT INTO pages (rowid, md5, page, text) VALUES (?, ?, ?, ?)",
+                     ((first+i, md5, i, page) for i,page in enumerate(pages)))
+    conn.execute("UPDATE docs SET first=?, pages=? WHERE rowid=?", (first, len(pages), docId))
+
+def _putMeta(conn, md5, fields):
+    docId, _, _ = _docId(conn, md5)
+    conn.execute("DELETE FROM works WHERE rowid=?", (docId,))
+    conn.execute("INSERT INTO works (rowid, md5, {}) VALUES (?, ?, {})".format(', '.join(_workCols), ', '.join('?'*len(_workCols))),
+                 (docId, md5) + tuple(fields.get(k) for k in _workCols))
+    conn.execute("DELETE FROM keywords WHERE md5=?", (md5,))
+    conn.executemany("INSERT INTO keywords (md5, field, term) VALUES (?, ?, ?)",
+                     ((md5, k, x) for k in _keywordCols for x in _keywords(k, fields.get(k))))
+
+def _keywordColumns(conn):
+    return [x[1] for x in conn.execute("PRAGMA table_info(works)") if x[1] in _keywordCols]
+
+def _keywords(field, value):
+    # Tags are separated by commas, the other keyword fields by spaces
+    if not value:
+        return set()
+    return {x.strip().lower() for x in (value.split(',') if field == 'tag' else value.split())} - {''}
+
+def _ftsTerm(t):
+    if t.startswith('"'):
+        return '"' + t.strip('"') + '"'
+    if t.endswith('*'):
+        return '"' + t.rstrip('*') + '"*'
+    return '"' + t + '"'
+
+def _yearRange(value):
+    # Accepts 2015, 2015..2018, ..2018 and Whoosh's [2015 TO 2018]
+    v = value.strip('[]').replace('TO', '..').replace(' ', '')
+    lo, _, hi = v.partition('..') if '..' in v else (v, None, v)
+    if not (lo or hi) or not all(x.isdigit() for x in (lo, hi) if x):
+        raise UserException("Bad year range: {}".format(value))
+    return int(lo) if lo else None, int(hi) if hi else None
+
+def _columnExpr(field, value):
+    # field:(a OR b) applies the field to the whole group, as in Whoosh
+    if value.startswith('(') and value.endswith(')'):
+        terms = [_operators.get(t) or _ftsTerm(t) for t in _groupRe.findall(value[1:-1])]
+        return "{} : ({})".format(field, ' '.join(terms))
+    return "{} : {}".format(field, _ftsTerm(value))
+
+def _isMeta(t):
+    m = _fieldRe.match(t)
+    return bool(m) and m.group(1) in metaFields
+
+def _metaGroupEnd(tokens, i):
+    # Index of the ) closing the group opened before tokens[i], if the
+    # group holds nothing but metadata clauses
+    depth = 1
+    for j in range(i, len(tokens)):
+        depth += {'(': 1, ')': -1}.get(tokens[j], 0)
+        if not depth:
+            inner = tokens[i:j]
+            if any(map(_isMeta, inner)) and all(_isMeta(x) or x in _operators or x in ('(', ')') for x in inner):
+                return j
+            return None
+    return None
+
+def _translate(term):
+    # Splits a query into an FTS5 expression over page text and a list of
+    # metadata clause groups ANDed onto it. The (negated, field, value)
+    # clauses within a group are joined by OR.
+    tokens = _tokenRe.findall(term)
+    items, meta, depth, last, i = [], [], 0, 0, 0
+    while i < len(tokens):
+        t = tokens[i]
+        i += 1
+        groups = None
+        if _isMeta(t):
+            if depth:
+                raise mixedQueryError()
+            field, value = _fieldRe.match(t).groups()
+            groups = [[(False, field, value)]]
+        elif t == '(' and not depth:
+            end = _metaGroupEnd(tokens, i)
+            if end is not None:
+                _, groups = _translate(' '.join(tokens[i:end]))
+                i = end + 1
+
+        if groups is not None:
+            if items and items[-1] in ('NOT', 'ANDNOT'):
+                items.pop()
+                # NOT (a OR b) is NOT a AND NOT b; NOT (a AND b) is NOT a OR NOT b
+                if len(groups) == 1:
+                    groups = [[(not neg, field, value)] for neg, field, value in groups[0]]
+                elif all(len(g) == 1 for g in groups):
+                    groups = [[(not neg, field, value) for [(neg, field, value)] in groups]]
+                else:
+                    raise mixedQueryError()
+            if items and items[-1] == 'OR':
+                if items[-2:-1] != [None]:
+                    raise mixedQueryError()
+                items.pop()
+                # Both sides are ANDs of OR groups; distribute the OR over them
+                groups = [a + b for a in meta[-last:] for b in groups]
+                del meta[-last:]
+            else:
+                while items and items[-1] == 'AND':
+                    items.pop()
+                items.append(None)
+            meta += groups
+            last = len(groups)
+            continue
+
+        if items[-2:] == [None, 'OR']:
+            raise mixedQueryError()
+        if items and items[-1] is None and t == 'AND':
+            continue
+        if t == '(':
+            depth += 1
+        elif t == ')':
+            depth -= 1
+        elif t in _operators:
+            t = _operators[t]
+        else:
+            t = _ftsTerm(t[5:] if t.startswith('text:') else t)
+        items.append(t)
+
+    return ' '.join(x for x in items if x is not None), meta
+
+def _keywordSql(field, value):
+    if value.startswith('(') and value.endswith(')'):
+        terms = _groupRe.findall(value[1:-1])
+        sqls = [_keywordSql(field, x) for x in terms if x not in _operators]
+        return "({})".format((' OR ' if 'OR' in terms else ' AND ').join(c for c, _ in sqls)), [x for _, p in sqls for x in p]
+    term = value.strip('"').strip().lower()
+    if term.endswith('*'):
+        return "md5 IN (SELECT md5 FROM keywords WHERE field = ? AND term >= ? AND term < ?)", [field, term[:-1], term[:-1] + '\U0010ffff']
+    return "md5 IN (SELECT md5 FROM keywords WHERE field = ? AND term = ?)", [field, term]
+
+def _clauseSql(neg, field, value):
+    if field == 'year':
+        lo, hi = _yearRange(value)
+        c = ' AND '.join(x for x, y in [("year >= ?", lo), ("year <= ?", hi)] if y is not None)
+        p = [x for x in (lo, hi) if x is not None]
+    elif field in _keywordCols:
+        c, p = _keywordSql(field, value)
+    else:
+        c, p = "md5 IN (SELECT md5 FROM works WHERE works MATCH ?)", [_columnExpr(field, value)]
+    return ("NOT ({})".format(c) if neg else c), p
+
+def _metaQuery(groups):
+    # Groups of plain column filters go into one MATCH so they are scored;
+    # the rest become SQL conditions.
+    match, conds, params = [], [], []
+    for group in groups:
+        if all(field not in ('year',) + _keywordCols and not neg for neg, field, _ in group):
+            match.append(' OR '.join("({})".format(_columnExpr(field, value)) for _, field, value in group))
+            continue
+        sqls = [_clauseSql(*x) for x in group]
+        conds.append("({})".format(' OR '.join(c for c, _ in sqls)))
+        params += [x for _, p in sqls for x in p]
+
+    score = "0.0"
+    if match:
+        conds.insert(0, "works MATCH ?")
+        params.insert(0, ' AND '.join("({})".format(x) for x in match))
+        score = "-bm25(works)"
+    return "SELECT md5, {} FROM works WHERE {}".format(score, ' AND '.join(conds) or "1"), params
+
+def _format(snip, formatter):
+    snip = ' '.join(snip.split())
+    if formatter == "html":
+        return _matchRe.sub(r'<span class="match">\1</span>', html.escape(snip))
+    if formatter == "ansi":
+        return wrapWithColor(_matchRe.sub(lambda m: stylize(m.group(1), fg('cyan') + attr('bold')), snip), firstIndent=4, indent=4)
+    return _matchRe.sub(lambda m: m.group(1).upper(), snip)
+
+class FtsSearch(TextSearch):
+    engine = "fts5"
+
+    @staticmethod
+    def path(dataDir):
+        return os.path.join(dataDir, ".fts5.db")
+
+    @classmethod
+    def exists(cls, dataDir):
+        return os.path.exists(cls.path(dataDir))
+
+    @staticmethod
+    def _connect(fname, **kwargs):
+        conn = sqlite3.connect(fname, timeout=60, isolation_level=None, **kwargs)
+        conn.execute("PRAGMA journal_mode = WAL")
+        for x in _tables:
+            conn.execute(x)
+        return conn
+
+    @classmethod
+    def create(cls, dataDir):
+        cls._connect(cls.path(dataDir)).close()
+
+    @classmethod
+    def remove(cls, dataDir):
+        fname = cls.path(dataDir)
+        with FileLock(fname + ".lck", what="full text index"):
+            for x in (fname, fname + "-wal", fname + "-shm"):
+                if os.path.exists(x):
+                    os.unlink(x)
+
+    @classmethod
+    def build(cls, dataDir, docs, metaDocs=(), procs=1):
+        # FTS5 indexes in one thread, so procs is unused. An existing index
+        # is rebuilt in a single transaction: readers see the old contents
+        # until it commits and a failed rebuild changes nothing.
+        fname = cls.path(dataDir)
+        with FileLock(fname + ".lck", what="full text index"):
+            if os.path.exists(fname):
+                return cls._build(fname, docs, metaDocs)
+
+            tmp = fname + ".new"
+            try:
+                counts = cls._build(tmp, docs, metaDocs)
+            except BaseException:
+                for x in (tmp, tmp + "-wal", tmp + "-shm"):
+                    if os.path.exists(x):
+                        os.unlink(x)
+                raise
+            os.rename(tmp, fname)
+            return counts
+
+    @classmethod
+    def _build(cls, fname, docs, metaDocs):
+        conn = cls._connect(fname)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for t in ("docs", "pages", "works", "keywords"):
+                conn.execute("DROP TABLE IF EXISTS " + t)
+            for x in _tables:
+                conn.execute(x)
+
+            nDocs = nPages = 0
+            for md5, pages in docs:
+                _addPages(conn, md5, pages)
+                nDocs += 1
+                nPages += len(pages)
+            for md5, fields in metaDocs:
+                _putMeta(conn, md5, fields)
+
+            conn.execute("INSERT INTO pages (pages) VALUES ('optimize')")
+            conn.execute("INSERT INTO works (works) VALUES ('optimize')")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return nDocs, nPages
+
+    def __init__(self, dataDir):
+        self.dbFile = self.path(dataDir)
+        self._local = threading.local()
+        self._writer = None
+        self._writeConn = None
+
+    def _conn(self):
+        # Readers get a connection per thread; WAL lets them run alongside
+        # the single writer connection.
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self._connect(self.dbFile)
+        return self._local.conn
+
+    @contextmanager
+    def batch(self, procs=1):
+        if self._writer:
+            yield self._writer
+            return
+
+        with FileLock(self.dbFile + ".lck", what="full text index"):
+            if self._writeConn is None:
+                self._writeConn = self._connect(self.dbFile, check_same_thread=False)
+            conn = self._writeConn
+            conn.execute("BEGIN IMMEDIATE")
+            self._writer = conn
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._writer = None
+
+    def add(self, md5, pages):
+        with self.batch() as conn:
+            _addPages(conn, md5, pages)
+
+    @property
+    def fielded(self):
+        return not _keywordColumns(self._conn())
+
+    def addFields(self, metaDocs):
+        # Indexes that kept key, doi and tag as stemmed columns of works
+        # get the keyword table filled and works remade without them.
+        with self.batch() as conn:
+            if not _keywordColumns(conn):
+                return 0
+            conn.execute("DROP TABLE works")
+            for x in _tables:
+                conn.execute(x)
+            n = 0
+            for md5, fields in metaDocs:
+                _putMeta(conn, md5, fields)
+                n += 1
+        return n
+
+    def putMeta(self, md5, fields):
+        with self.batch() as conn:
+            _putMeta(conn, md5, fields)
+
+    def delete(self, md5):
+        with self.batch() as conn:
+            row = conn.execute("SELECT rowid, first, pages FROM docs WHERE md5=?", (md5,)).fetchone()
+            if row is None:
+                return
+            docId, first, n = row
+            if n:
+                conn.execute("DELETE FROM pages WHERE rowid BETWEEN ? AND ?", (first, first+n-1))
+            conn.execute("DELETE FROM works WHERE rowid=?", (docId,))
+            conn.execute("DELETE FROM keywords WHERE md5=?", (md5,))
+            conn.execute("DELETE FROM docs WHERE rowid=?", (docId,))
+
+    def search(self, term, formatter=None, limit=None, offset=0):
+        text, meta = _translate(term)
+        if not (text or meta):
+            return [], 0
+
+        conn = self._conn()
+        metaSql, params = _metaQuery(meta)
+        try:
+            if not text:
+                docs = sorted(conn.execute(metaSql, params), key=lambda x: x[1], reverse=True)
+                hits = [(md5, score, []) for md5, score in docs[offset:offset+limit if limit else None]]
+                return sorted(hits, key=lambda x:x[1]), len(docs)
+
+            sql = "SELECT md5, page, -bm25(pages) FROM pages WHERE pages MATCH ?"
+            if meta:
+                sql += " AND md5 IN (SELECT md5 FROM ({}))".format(metaSql)
+
+            scores = {}
+            for md5, page, score in conn.execute(sql, [text] + params):
+                scores[md5] = scores.get(md5, 0.0) + score
+            docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            window = docs[offset:offset+limit if limit else None]
+
+            # Snippets are only made for the documents being shown
+            frags = {}
+            if window:
+                sql = "SELECT md5, page, snippet(pages, 2, ?, ?, ?, 32) FROM pages WHERE pages MATCH ? AND md5 IN ({})"
+                for md5, page, snip in conn.execute(sql.format(', '.join('?'*len(window))),
+                                                    ['\x02', '\x03', '…', text] + [md5 for md5, _ in window]):
+                    frags.setdefault(md5, []).append(dict(page=page+1, frag=_format(snip, formatter)))
+        except sqlite3.OperationalError as err:
+            if not str(err).startswith(("fts5", "no such column", "unknown special query")):
+                raise
+            raise UserException("Bad search query {!r}: {}".format(term, err))
+
+        hits = [(md5, score, sorted(frags.get(md5, []), key=lambda x:x['page'])) for md5, score in window]
+        return sorted(hits, key=lambda x:x[1]), len(docs)
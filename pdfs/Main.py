@@ -4,12 +4,13 @@ import argparse
 
 import argcomplete
 
-from .Exceptions import AbortException, UserException, WorkExistsException, RepositoryException
+from .Exceptions import AbortException, UserException, WorkExistsException, RepositoryException, CrossrefException
 from .Database import Database
+from . import Crossref
 from .TermOutput import msg
 from .Commands import *
 from .Commands.Command import Registry
-from .Cache import RequestCache
+from .Cache import RequestCache, FileHashCache
 
 def main():
     parser = argparse.ArgumentParser()
@@ -23,6 +24,9 @@ def main():
 
     parser.add_argument("--data-dir", help="Path to articles directory", type=str, default=None)
 
+    parser.add_argument("--mailto", help="Contact address sent to Crossref with each request (default: $PDFS_MAILTO)",
+                        metavar="EMAIL", type=str, default=None)
+
     subparsers = parser.add_subparsers(title='Commands', dest='_commandName')
 
     for cmdType in Registry.commands:
@@ -43,9 +47,13 @@ def main():
     else:
         msg.setup(level=args.logging_level)
 
+    if args.mailto:
+        Crossref.configure(contact=args.mailto)
+
     ddir = Database.getDataDir(dataDir=args.data_dir)
     if ddir:
-        RequestCache(os.path.join(ddir, ".cache.pkl"))
+        RequestCache(os.path.join(ddir, ".cache.db"), legacyFile=os.path.join(ddir, ".cache.pkl"))
+        FileHashCache(os.path.join(ddir, ".hashes.db"))
 
     try:
         if hasattr(args, "func"):
@@ -62,7 +70,7 @@ def main():
     except AbortException:
         msg.error("Aborted")
         sys.exit(1)
-    except (WorkExistsException, RepositoryException) as e:
+    except (WorkExistsException, RepositoryException, CrossrefException) as e:
         msg.error(str(e))
         sys.exit(1)
     except:
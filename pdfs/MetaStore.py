@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import zlib
+
+_schema = """
+CREATE TABLE IF NOT EXISTS works (
+    md5        TEXT PRIMARY KEY,
+    citeKey    TEXT NOT NULL,
+    doi        TEXT,
+    type       TEXT NOT NULL,
+    importDate TEXT NOT NULL,
+    bibtex     TEXT NOT NULL,
+    meta       TEXT NOT NULL,
+    bibtexEdited INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS worksCiteKey ON works(citeKey);
+CREATE INDEX IF NOT EXISTS worksDoi ON works(doi COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS files (
+    work  TEXT NOT NULL REFERENCES works(md5) ON DELETE CASCADE ON UPDATE CASCADE,
+    idx   INTEGER NOT NULL,
+    md5   TEXT NOT NULL,
+    label TEXT NOT NULL,
+    file  TEXT NOT NULL,
+    PRIMARY KEY (work, idx)
+);
+CREATE INDEX IF NOT EXISTS filesMd5 ON files(md5);
+
+CREATE TABLE IF NOT EXISTS tags (
+    work TEXT NOT NULL REFERENCES works(md5) ON DELETE CASCADE ON UPDATE CASCADE,
+    tag  TEXT NOT NULL,
+    PRIMARY KEY (work, tag)
+);
+CREATE INDEX IF NOT EXISTS tagsTag ON tags(tag);
+
+CREATE TABLE IF NOT EXISTS raw (
+    work    TEXT PRIMARY KEY REFERENCES works(md5) ON DELETE CASCADE ON UPDATE CASCADE,
+    payload BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS review (
+    path   TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    dois   TEXT NOT NULL
+);
+"""
+
+# user_version 1: works.meta holds trimmed metadata, raw the full message
+schemaVersion = 1
+
+# Changes are appended to the write-ahead log (.metadata.db-wal) and folded
+# back into the main file once the log grows past this many pages.
+journalPages = 1000
+
+class MetaStore:
+    def __init__(self, fname):
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA wal_autocheckpoint = {:d}".format(journalPages))
+        self.conn.execute("PRAGMA journal_size_limit = {:d}".format(journalPages*4096))
+        self.conn.executescript(_schema)
+        if "bibtexEdited" not in [x[1] for x in self.conn.execute("PRAGMA table_info(works)")]:
+            self.conn.execute("ALTER TABLE works ADD COLUMN bibtexEdited INTEGER NOT NULL DEFAULT 0")
+        if self.version < schemaVersion and not self.conn.execute("SELECT 1 FROM works LIMIT 1").fetchone():
+            self.conn.execute("PRAGMA user_version = {:d}".format(schemaVersion))
+        self.conn.commit()
+
+    @property
+    def version(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def records(self, where="1", params=(), withMeta=True):
+        files, tags = {}, {}
+        subq = "SELECT md5 FROM works WHERE " + where
+
+        for work, md5, label, fname in self.conn.execute(
+                "SELECT work, md5, label, file FROM files WHERE work IN ({}) ORDER BY work, idx".format(subq), params):
+            md5s, labels, fnames = files.setdefault(work, ([], [], []))
+            md5s.append(md5)
+            labels.append(label)
+            fnames.append(fname)
+
+        for work, tag in self.conn.execute("SELECT work, tag FROM tags WHERE work IN ({}) ORDER BY work, tag".format(subq), params):
+            tags.setdefault(work, []).append(tag)
+
+        cols = "md5, citeKey, doi, type, importDate, bibtex, bibtexEdited" + (", meta" if withMeta else "")
+        works = []
+        for row in self.conn.execute("SELECT {} FROM works WHERE {} ORDER BY rowid".format(cols, where), params):
+            md5, citeKey, doi, tp, importDate, bibtex, edited = row[:7]
+            md5s, labels, fnames = files.get(md5, ([], [], []))
+            d = dict(citeKey=citeKey, doi=doi, type=tp, tags=tags.get(md5, []),
+                     files=fnames, fileLabels=labels, md5s=md5s,
+                     importDate=importDate, bibtex=bibtex, bibtexEdited=bool(edited))
+            if withMeta:
+                d['meta'] = json.loads(row[7])
+            works.append(d)
+        return works
+
+    def findRecord(self, *, key=None, md5=None, doi=None):
+        if key:
+            rs = self.records("citeKey=?", (key,), withMeta=False)
+        elif md5:
+            rs = self.records("md5 IN (SELECT work FROM files WHERE md5=?)", (md5,), withMeta=False)
+        elif doi:
+            rs = self.records("doi=? COLLATE NOCASE", (doi,), withMeta=False)
+        else:
+            rs = []
+        if rs:
+            return rs[0]
+
+    def loadMeta(self, md5):
+        meta, = self.conn.execute("SELECT meta FROM works WHERE md5=?", (md5,)).fetchone()
+        return json.loads(meta)
+
+    def loadRaw(self, md5):
+        row = self.conn.execute("SELECT payload FROM raw WHERE work=?", (md5,)).fetchone()
+        if row:
+            return json.loads(zlib.decompress(row[0]))
+
+    def putRaw(self, md5, meta):
+        self.conn.execute("INSERT OR REPLACE INTO raw (work, payload) VALUES (?, ?)",
+                          (md5, zlib.compress(json.dumps(meta, sort_keys=True).encode())))
+
+    def splitRaw(self, trim):
+        n = 0
+        with self.conn:
+            for md5, meta in self.conn.execute("SELECT md5, meta FROM works").fetchall():
+                meta = json.loads(meta)
+                self.putRaw(md5, meta)
+                self.conn.execute("UPDATE works SET meta=? WHERE md5=?", (json.dumps(trim(meta), sort_keys=True), md5))
+                n += 1
+            self.conn.execute("PRAGMA user_version = {:d}".format(schemaVersion))
+        self.conn.execute("VACUUM")
+        return n
+
+    def citeKeys(self):
+        return [x for x, in self.conn.execute("SELECT citeKey FROM works ORDER BY rowid")]
+
+    def tags(self):
+        return [x for x, in self.conn.execute("SELECT DISTINCT tag FROM tags")]
+
+    def putWork(self, d):
+        md5 = d['md5s'][0]
+        row = (d['citeKey'], d['meta'].get('DOI'), d['meta']['type'], d['importDate'], d['bibtex'],
+               json.dumps(d['meta'], sort_keys=True), int(d.get('bibtexEdited', False)), md5)
+        # Upserts need SQLite 3.24, and INSERT OR REPLACE would delete the
+        # row, cascading to the work's files and tags.
+        cur = self.conn.execute("""UPDATE works SET citeKey=?, doi=?, type=?, importDate=?, bibtex=?, meta=?, bibtexEdited=?
+                                   WHERE md5=?""", row)
+        if cur.rowcount == 0:
+            self.conn.execute("""INSERT INTO works (citeKey, doi, type, importDate, bibtex, meta, bibtexEdited, md5)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", row)
+
+        if d.get('rawMeta') is not None:
+            self.putRaw(md5, d['rawMeta'])
+
+        self.conn.execute("DELETE FROM files WHERE work=?", (md5,))
+        self.conn.executemany("INSERT INTO files (work, idx, md5, label, file) VALUES (?, ?, ?, ?, ?)",
+                              ((md5, i, m, l, f) for i, (m, l, f) in enumerate(zip(d['md5s'], d['fileLabels'], d['files']))))
+
+        self.conn.execute("DELETE FROM tags WHERE work=?", (md5,))
+        self.conn.executemany("INSERT INTO tags (work, tag) VALUES (?, ?)", ((md5, t) for t in set(d['tags'])))
+
+    def deleteWork(self, md5):
+        self.conn.execute("DELETE FROM works WHERE md5=?", (md5,))
+
+    def reviewQueue(self):
+        return [(p, r, json.loads(d)) for p, r, d in self.conn.execute("SELECT path, reason, dois FROM review ORDER BY rowid")]
+
+    def putReview(self, path, reason, dois):
+        self.conn.execute("INSERT OR REPLACE INTO review (path, reason, dois) VALUES (?, ?, ?)", (path, reason, json.dumps(dois)))
+
+    def deleteReview(self, path):
+        self.conn.execute("DELETE FROM review WHERE path=?", (path,))
+
+    def migrateJson(self, jsonFile, trim):
+        ds = json.load(open(jsonFile))
+        with self.conn:
+            for d in ds:
+                self.putWork(dict(d, meta=trim(d['meta']), rawMeta=d['meta']))
+        return len(ds)
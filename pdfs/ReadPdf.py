@@ -1,21 +1,47 @@
 import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
 from io import StringIO
-from functools import lru_cache
+from itertools import repeat
 
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams
+from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import PDFStream, resolve1
+from pdfminer.utils import decode_text
 from unidecode import unidecode
 
-from .Cache import cachedRequest
+from .Cache import cachedRequest, FileHashCache
 from .Exceptions import UserException
 
-def getPdfTxt(fname):
-    return _getPdf(fname, cache_key=md5sum(fname))
+def getPdfTxt(fname, md5=None):
+    return _getPdf(fname, cache_key=md5 or md5sum(fname))
+
+def hasPdfTxt(md5):
+    return _getPdf.cached(md5)
+
+def storePdfTxt(md5, pages):
+    _getPdf.prime(md5, pages)
+
+def dropPdfTxt(md5):
+    _getPdf.forget(md5)
 
 @cachedRequest("PDF")
 def _getPdf(fname, cache_key=None):
+    return extractPdfTxt(fname)
+
+# Documents with at least this many pages have their pages split across
+# worker processes.
+parallelPages = 16
+
+def _pageCount(fname):
+    with open(fname, 'rb') as fp:
+        return sum(1 for _ in PDFPage.create_pages(PDFDocument(PDFParser(fp))))
+
+def _pageTexts(fname, pagenos=None):
     rsrcmgr = PDFResourceManager()
     retstr = StringIO()
     codec = 'utf-8'
@@ -26,23 +52,84 @@ def _getPdf(fname, cache_key=None):
     password = ""
     maxpages = 0
     caching = True
-    pagenos=set()
+    pagenos = pagenos or set()
+    texts = []
 
     for page in PDFPage.get_pages(fp, pagenos, maxpages=maxpages, password=password,caching=caching, check_extractable=True):
         interpreter.process_page(page)
         print('\f', file=retstr)
-
-    text = retstr.getvalue()
+        texts.append(retstr.getvalue())
+        retstr.seek(0)
+        retstr.truncate()
 
     fp.close()
     device.close()
     retstr.close()
-    
+
+    return texts
+
+def extractPdfTxt(fname, procs=None):
+    procs = procs or len(os.sched_getaffinity(0))
+    nPages = _pageCount(fname) if procs > 1 else 0
+
+    if nPages < parallelPages:
+        texts = _pageTexts(fname)
+    else:
+        step = -(-nPages // (4*procs))
+        chunks = [set(range(i, min(i+step, nPages))) for i in range(0, nPages, step)]
+        with ProcessPoolExecutor(min(procs, len(chunks))) as pool:
+            texts = [t for ts in pool.map(_pageTexts, repeat(fname), chunks) for t in ts]
+
+    return _splitPages(texts)
+
+def scanPdf(fname):
+    try:
+        return extractPdfTxt(fname, procs=1), None
+    except Exception as e:
+        return None, "{}({})".format(type(e).__name__, e)
+
+def _splitPages(texts):
+    text = ''.join(texts)
     return [unidecode(x) for x in text.split("\f") if x.strip()]
 
-@lru_cache(maxsize=32)
+def firstPagesTxt(fname, n):
+    return _splitPages(_pageTexts(fname, set(range(n))))
+
+def _pdfStr(x):
+    x = resolve1(x)
+    if isinstance(x, bytes):
+        return decode_text(x)
+    if isinstance(x, PDFStream):
+        return x.get_data().decode('utf-8', 'ignore')
+    if isinstance(x, str):
+        return x
+    return ''
+
+def pdfMetadataTxt(fname):
+    with open(fname, 'rb') as fp:
+        doc = PDFDocument(PDFParser(fp))
+        strs = [_pdfStr(v) for info in doc.info for v in info.values()]
+        if 'Metadata' in doc.catalog:
+            strs.append(_pdfStr(doc.catalog['Metadata']))
+    return '\n'.join(strs)
+
+def _md5File(fname, chunkSize=1<<20):
+    h = hashlib.md5()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
 def md5sum(fname):
+    path = os.path.abspath(fname)
     try:
-        return hashlib.md5(open(fname,"rb").read()).hexdigest()
+        st = os.stat(path)
     except FileNotFoundError:
         raise UserException("File {} not found".format(fname))
+
+    hc = FileHashCache()
+    md5 = hc.get(path, st)
+    if md5 is None:
+        md5 = _md5File(path)
+        hc.put(path, st, md5)
+    return md5
@@ -0,0 +1,53 @@
+from .BaseWork import Work, trimMeta
+from .Crossref import crossrefUpdates
+from .TermOutput import msg
+
+def _deposited(meta):
+    try:
+        return meta['deposited']['date-time'][:10]
+    except (KeyError, TypeError):
+        return None
+
+def _handEdited(e):
+    return e.bibtexEdited or e.bibtex != e.bibtexFromMetadata()
+
+def refreshWorks(db, works, force=False, includeEdited=False):
+    byDoi = {}
+    for e in works:
+        if e.doi():
+            byDoi.setdefault(e.doi(), []).append(e)
+        else:
+            msg.info("%s has no DOI, skipping", e.key())
+
+    since = {doi: None if force else _deposited(es[0].meta) for doi, es in byDoi.items()}
+    msg.info("Checking %d works against Crossref", len(since))
+    updated = crossrefUpdates(since)
+
+    changed, edited = [], []
+    for doi, meta in updated.items():
+        for e in byDoi[doi]:
+            if trimMeta(meta) == e.meta:
+                continue
+            if not includeEdited and _handEdited(e):
+                edited.append(e)
+                continue
+
+            d = e.toDict()
+            d.update(meta=meta, rawMeta=meta, bibtex=None, bibtexEdited=False)
+            try:
+                new = Work.from_db(**d)
+            except ValueError as ex:
+                msg.warning("%s: %s", e.key(), ex)
+                continue
+            changed.append((e, new))
+
+    with db.transaction(), db.textSearch.batch():
+        for old, new in changed:
+            db.replace(old, new)
+            msg.info("Updated %s", new.key())
+
+    for e in edited:
+        msg.warning("%s has hand-edited bibtex, not updated (use --include-edited to overwrite)", e.key())
+
+    msg.info("%d of %d works updated, %d hand-edited skipped", len(changed), len(works), len(edited))
+    return [new for _, new in changed]
@@ -0,0 +1,220 @@
+import argparse
+import bisect
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from .Exceptions import UserException
+from .HTMLBib import authorNorm
+from .TermOutput import msg
+from .TextSearch import TextSearch, fieldQuery
+
+# Compares the full text search engines on one corpus: index build time and
+# size, single document adds (as `pdfs add` does them) and query latency,
+# plus how far their top 10 documents agree. The corpus is the text of a
+# repository's PDFs or, with --synthetic, generated pages.
+#
+#   python -m pdfs.SearchBench [--data-dir articles] [-r 20] [QUERY ...]
+#
+# --check instead runs the queries the web UI sends on every engine and
+# reports where the matching works differ.
+
+def repoCorpus(dataDir):
+    from .Cache import RequestCache
+    from .Database import Database
+    from .ReadPdf import getPdfTxt
+
+    dataDir = Database.getDataDir(dataDir=dataDir)
+    if dataDir:
+        RequestCache(os.path.join(dataDir, ".cache.db"))
+    db = Database(dataDir=dataDir, lazy=True)
+
+    docs, metaDocs = [], []
+    for e in db.works:
+        if 'PDF' in e.fileLabels:
+            md5 = e.md5s[e.fileLabels.index('PDF')]
+            docs.append((md5, getPdfTxt(db.getFile(e), md5)))
+        metaDocs.append((e.md5s[0], db.searchFields(e)))
+    return docs, metaDocs
+
+def syntheticCorpus(nPages, pagesPerDoc=20, wordsPerPage=400, seed=1):
+    # Word frequencies follow Zipf's law, as in natural language text
+    rng = random.Random(seed)
+    vocab = sorted({''.join(rng.choice("bcdfghklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(2, 5)))
+                    for _ in range(30000)})
+    rng.shuffle(vocab)
+    cumWeights = list(itertools.accumulate(1/(i+1) for i in range(len(vocab))))
+
+    def words(n):
+        return ' '.join(vocab[bisect.bisect(cumWeights, rng.random()*cumWeights[-1])] for _ in range(n))
+
+    # Tags that share words or stems, which must still match separately
+    tags = ["review", "reviews", "peer review", "rna", "RNA-seq"]
+
+    docs, metaDocs = [], []
+    for i in range((nPages + pagesPerDoc - 1) // pagesPerDoc):
+        md5 = "{:032x}".format(rng.getrandbits(128))
+        docs.append((md5, [words(wordsPerPage) for _ in range(pagesPerDoc)]))
+        metaDocs.append((md5, dict(key="Doc{}".format(i), title=words(8), author=words(2).title(),
+                                   journal=words(3), year=1990 + i % 30, tag="bench," + tags[i % len(tags)])))
+    return docs, metaDocs
+
+def defaultQueries(docs, metaDocs):
+    counts = Counter(w for _, pages in docs[:200] for p in pages[:5] for w in p.lower().split() if w.isalpha() and len(w) > 4)
+    ranked = [w for w, _ in counts.most_common()]
+    if not ranked:
+        return []
+    common, mid, rare = ranked[0], ranked[len(ranked)//20], ranked[-1]
+    queries = [common, mid, rare, "{} {}".format(common, mid), "{} OR {}".format(mid, rare),
+               mid[:4] + "*", "{} year:2000..2010".format(common)]
+    authors = [f['author'] for _, f in metaDocs if f.get('author')]
+    if authors:
+        queries.append("author:{}".format(authors[0].split(',')[0].split()[-1].lower()))
+    return list(dict.fromkeys(queries))
+
+def wwwQueries(docs, metaDocs, n=3):
+    # Every tag is checked; authors and titles of the first n works
+    fields = [f for _, f in metaDocs[:n]]
+    tags = sorted({t.strip() for _, f in metaDocs for t in (f.get('tag') or '').split(',') if t.strip()})
+    # Author links carry the authorNorm'd last name of each author
+    authors = [authorNorm(f['author'].split(' and ')[0].split(',')[0]) for f in fields if f.get('author')]
+    titles = [' '.join(f['title'].split()[:2]) for f in fields if f.get('title')]
+
+    queries = [fieldQuery('tag', x) for x in tags]
+    queries += [fieldQuery('author', x) for x in authors]
+    queries += [fieldQuery('title', x) for x in titles]
+    if len(tags) > 1:
+        queries.append("{} OR {}".format(fieldQuery('tag', tags[0]), fieldQuery('tag', tags[1])))
+    if len(authors) > 1:
+        queries.append("{} OR {}".format(fieldQuery('author', authors[0]), fieldQuery('author', authors[1])))
+    if len(titles) > 1:
+        queries.append(fieldQuery('title', "{} OR {}".format(titles[0].split()[0], titles[1].split()[0])))
+    words = [w for w, _ in Counter(w for _, pages in docs[:50] for p in pages[:2] for w in p.lower().split() if w.isalpha() and len(w) > 4).most_common(1)]
+    if words and queries:
+        queries.append("{} {}".format(words[0], queries[0]))
+    if words and len(tags) > 1:
+        queries.append("{} AND ({} OR {})".format(words[0], fieldQuery('tag', tags[0]), fieldQuery('tag', tags[-1])))
+    return queries
+
+def check(engines, docs, metaDocs, queries):
+    results = {}
+    for name, engine in engines.items():
+        pth = tempfile.mkdtemp(prefix="pdfs-check-")
+        try:
+            engine.build(pth, docs, metaDocs)
+            ts = engine(pth)
+            for q in queries:
+                try:
+                    results[name, q] = {x[0] for x in ts.search(q)[0]}
+                except UserException as e:
+                    results[name, q] = e
+        finally:
+            shutil.rmtree(pth)
+
+    failed = 0
+    msg("{:<40}".format("query") + "".join("{:>12}".format(x) for x in engines))
+    for q in queries:
+        rs = [results[x, q] for x in engines]
+        ok = not any(isinstance(x, Exception) for x in rs) and all(x == rs[0] for x in rs)
+        failed += not ok
+        msg("{:<40}".format(q[:39]) + "".join("{:>12}".format("error" if isinstance(x, Exception) else len(x)) for x in rs) + ("" if ok else "  differs"))
+        for x in rs:
+            if isinstance(x, Exception):
+                msg.error("%s", x)
+    return failed
+
+def _median(fn, repeat):
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+def _dirSize(pth):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(pth) for f in fs)
+
+def bench(engine, docs, metaDocs, queries, repeat=10, adds=5, procs=1):
+    pth = tempfile.mkdtemp(prefix="pdfs-bench-")
+    try:
+        t0 = time.perf_counter()
+        engine.build(pth, docs, metaDocs, procs=procs)
+        r = dict(build=time.perf_counter() - t0, size=_dirSize(pth))
+
+        ts = engine(pth)
+        fields = dict(metaDocs)
+        addTimes = []
+        for md5, pages in sorted(docs, key=lambda x: -len(x[1]))[:adds]:
+            ts.delete(md5)
+            t0 = time.perf_counter()
+            ts.add(md5, pages)
+            addTimes.append(time.perf_counter() - t0)
+            if md5 in fields:
+                ts.putMeta(md5, fields[md5])
+        r['add'] = statistics.median(addTimes) if addTimes else 0
+
+        r['queries'] = []
+        for q in queries:
+            hits, total = ts.search(q, limit=10)
+            r['queries'].append(dict(top=_median(lambda: ts.search(q, limit=10), repeat),
+                                     all=_median(lambda: ts.search(q), repeat),
+                                     total=total, md5s={x[0] for x in hits}))
+        return r
+    finally:
+        shutil.rmtree(pth)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pdfs full text search engines on one corpus")
+    parser.add_argument("queries", nargs="*", metavar="QUERY", help="Queries to time (default: picked from the corpus)")
+    parser.add_argument("--data-dir", help="Repository whose PDF text is the corpus", type=str, default=None)
+    parser.add_argument("--synthetic", metavar="PAGES", type=int, default=None, help="Use this many generated pages instead")
+    parser.add_argument("--repeat", "-r", type=int, default=10, help="Timed runs per query")
+    parser.add_argument("--adds", type=int, default=5, help="Single document adds to time")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Indexing processes, for engines that use them")
+    parser.add_argument("--engines", nargs="+", default=None, help="Engines to compare (default: all)")
+    parser.add_argument("--check", action="store_true", help="Check that the engines agree on the web UI's queries instead")
+    parser.add_argument("--logging-level", "-L", metavar="LEVEL", type=str, default="INFO")
+    args = parser.parse_args()
+
+    msg.setup(level=args.logging_level)
+    if args.synthetic:
+        docs, metaDocs = syntheticCorpus(args.synthetic)
+    else:
+        docs, metaDocs = repoCorpus(args.data_dir)
+    engines = {k: v for k, v in TextSearch.engines().items() if not args.engines or k in args.engines}
+    if args.check:
+        sys.exit(1 if check(engines, docs, metaDocs, args.queries or wwwQueries(docs, metaDocs)) else 0)
+    queries = args.queries or defaultQueries(docs, metaDocs)
+
+    nPages = sum(len(p) for _, p in docs)
+    msg("Corpus: %d documents, %d pages, %.1f MB of text", len(docs), nPages, sum(len(x) for _, p in docs for x in p)/(1<<20))
+
+    results = {}
+    for name, engine in engines.items():
+        msg.info("Benchmarking %s", name)
+        results[name] = bench(engine, docs, metaDocs, queries, args.repeat, args.adds, args.jobs)
+
+    msg()
+    msg("{:<8} {:>9} {:>9} {:>9} {:>9}".format("engine", "build s", "pages/s", "size MB", "add ms"))
+    for name, r in results.items():
+        msg("{:<8} {:>9.2f} {:>9.0f} {:>9.1f} {:>9.1f}".format(name, r['build'], nPages/r['build'], r['size']/(1<<20), 1000*r['add']))
+
+    msg()
+    msg("Query times in ms for the top 10 / all documents, and the number of matches")
+    msg("{:<32}".format("query") + "".join("{:>22}".format(x) for x in results) + ("  top 10 overlap" if len(results) == 2 else ""))
+    for i, q in enumerate(queries):
+        rs = [r['queries'][i] for r in results.values()]
+        line = "{:<32}".format(q[:31]) + "".join("{:>22}".format("{:.1f} / {:.1f} ({})".format(1000*x['top'], 1000*x['all'], x['total'])) for x in rs)
+        if len(rs) == 2:
+            line += "  {:>15}".format("{}/{}".format(len(rs[0]['md5s'] & rs[1]['md5s']), max(len(rs[0]['md5s']), len(rs[1]['md5s']))))
+        msg(line)
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,102 @@
 import os
-import shutil
 import re
+import threading
 
-import whoosh.highlight as highlight
-import whoosh.index as widx
-from whoosh.analysis import CharsetFilter, StemmingAnalyzer
-from whoosh.fields import Schema, ID, NUMERIC, TEXT
-from whoosh.qparser import QueryParser
-from whoosh.support.charset import accent_map
+from .Exceptions import RepositoryException, UserException
 
-from .TermOutput import msg, wrapWithColor, fg, bg, attr, stylize
+# Batches with at least this many pages are indexed by several processes,
+# each writing its own segment.
+mpWriterPages = 500
 
-class ANSIFormatter(highlight.Formatter):
-    wsRe = re.compile(r"\s+")
-    def format_token(self, text, token, replace=False):
-        tokentext = highlight.get_text(text, token, replace)
-        return stylize(tokentext, fg('cyan') + attr('bold'))
+defaultEngine = "whoosh"
 
-    def format(self, fragments, replace=False):
-        s = super().format(fragments, replace).strip()
-        s = ' '.join(self.wsRe.split(s))
-        return wrapWithColor(s, firstIndent=4, indent=4)
+# Each work also gets one document holding these metadata fields. It has no
+# text field, so plain full text queries never match it.
+metaFields = ('key', 'title', 'author', 'journal', 'year', 'doi', 'tag')
+
+# year:2015..2018 is shorthand for Whoosh's year:[2015 TO 2018]
+_rangeRe = re.compile(r'\b(\w+):([^\s\[\]]*)\.\.([^\s\[\]]*)')
+
+def _expandRange(m):
+    field, lo, hi = m.groups()
+    return "{}:[{}]".format(field, " ".join(filter(None, [lo, "TO", hi])))
+
+def expandRanges(term):
+    return _rangeRe.sub(_expandRange, term)
+
+def mixedQueryError():
+    return UserException("Metadata fields ({}) can only be combined with full text search using AND".format(', '.join(metaFields)))
+
+def fieldQuery(field, value):
+    # The queries behind the web UI's tag, author and title views. Author
+    # links carry authorNorm'd names, which have _ for spaces.
+    value = value.replace('"', '')
+    if field == 'title':
+        return 'title:({})'.format(re.sub(r'[():]', ' ', value))
+    if field == 'author':
+        value = value.replace('_', ' ')
+    return '{}:"{}"'.format(field, value)
+
+def writerProcs(nPages):
+    if nPages < mpWriterPages:
+        return 1
+    return len(os.sched_getaffinity(0))
 
 class TextSearch:
+    # Engines implement the class methods exists/create/build/remove and the
+    # instance methods batch/add/putMeta/delete/search. search returns
+    # ([(md5, score, [dict(page=, frag=)])] ascending by score, number of
+    # matching works).
+    engine = None
+
+    _instances = {}
+    _instancesLock = threading.Lock()
+
     @staticmethod
-    def init(dataDir):
-        pth = os.path.join(dataDir, ".whoosh")
-        try:
-            os.mkdir(pth)
-        except FileExistsError:
-            shutil.rmtree(pth)
-            os.mkdir(pth)
-
-        analyzer= StemmingAnalyzer() | CharsetFilter(accent_map)
-        schema = Schema(md5=ID(stored=True),
-                        page=NUMERIC(stored=True),
-                        text=TEXT(stored=True, analyzer=analyzer))
-        widx.create_in(pth, schema)
-
-    def __init__(self, dataDir):
-        self.ix = widx.open_dir(os.path.join(dataDir, ".whoosh"))
-
-    def add(self, md5, pages):
-        with self.ix.writer() as writer:
-            for i,page in enumerate(pages):
-                writer.add_document(md5=md5, page=i, text=page)
-
-    def delete(self, md5):
-        with self.ix.writer() as writer:
-            writer.delete_by_term("md5", md5)
-
-    def search(self, term, formatter=None):
-        if formatter == "html":
-            formatter = highlight.HtmlFormatter(tagname='span', classname='match', between='<span class="searchSep"></span>')
-        elif formatter == "ansi":
-            formatter = ANSIFormatter()
+    def engines():
+        from .WhooshSearch import WhooshSearch
+        from .FtsSearch import FtsSearch
+        return {x.engine: x for x in (WhooshSearch, FtsSearch)}
+
+    @staticmethod
+    def engineOf(dataDir):
+        # Both exist only if a migration stopped before removing the old
+        # index; the newer one is then the one to use.
+        found = [x for x in TextSearch.engines().values() if x.exists(dataDir)]
+        if not found:
+            raise RepositoryException("No full text index in {}, run `pdfs reindex`".format(dataDir))
+        return max(found, key=lambda x: os.stat(x.path(dataDir)).st_mtime)
+
+    @classmethod
+    def open(cls, dataDir):
+        engine = TextSearch.engineOf(dataDir)
+        key = os.path.realpath(dataDir), engine.engine
+        with cls._instancesLock:
+            if key not in cls._instances:
+                cls._instances[key] = engine(dataDir)
+            return cls._instances[key]
+
+    @staticmethod
+    def init(dataDir, engine=defaultEngine):
+        TextSearch.engines()[engine].create(dataDir)
+
+    @staticmethod
+    def rebuild(dataDir, docs, metaDocs=(), procs=1, engine=None):
+        old = [x for x in TextSearch.engines().values() if x.exists(dataDir)]
+        if engine:
+            new = TextSearch.engines()[engine]
         else:
-            formatter = highlight.UppercaseFormatter()
-
-        with self.ix.searcher() as searcher:
-            q = QueryParser("text", self.ix.schema).parse(term)
-            results = searcher.search(q, limit=None)
-            results.fragmenter.charlimit = None
-            results.fragmenter.maxchars = 300
-            results.fragmenter.surround = 50
-            results.formatter = formatter
-            pgDict = {}
-
-            for hit in results:
-                sk = hit['md5']
-                r = dict(page=hit['page'], frag=hit.highlights("text",top=10), score=hit.score)
-
-                if sk in pgDict:
-                    pgDict[sk].append(r)
-                else:
-                    pgDict[sk] = [r]
-
-        hits = []
-
-        for md5, rs in pgDict.items():
-            score = sum(x['score'] for x in rs)
-            fragments = [dict(page=x['page']+1, frag=x['frag']) for x in sorted(rs, key=lambda x:x['page'])]
-            hits.append( (md5, score, fragments) )
-
-        return sorted(hits, key=lambda x:x[1])
+            new = TextSearch.engineOf(dataDir) if old else TextSearch.engines()[defaultEngine]
+
+        counts = new.build(dataDir, docs, metaDocs, procs)
+        for x in old:
+            if x is not new:
+                x.remove(dataDir)
+        return counts
+
+    @property
+    def fielded(self):
+        return True
+
+    def addFields(self, metaDocs):
+        return 0
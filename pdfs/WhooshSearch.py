@@ -0,0 +1,262 @@
+import os
+import shutil
+import re
+import threading
+from contextlib import contextmanager
+
+import whoosh.highlight as highlight
+import whoosh.index as widx
+import whoosh.query as query
+from whoosh.analysis import CharsetFilter, LowercaseFilter, RegexTokenizer, StemmingAnalyzer
+from whoosh.fields import Schema, ID, KEYWORD, NUMERIC, TEXT
+from whoosh.qparser import QueryParser
+from whoosh.searching import Hit
+from whoosh.support.charset import accent_map
+
+from .FileLock import FileLock
+from .TermOutput import msg, wrapWithColor, fg, bg, attr, stylize
+from .TextSearch import TextSearch, metaFields, expandRanges, mixedQueryError
+
+def _fieldTypes():
+    analyzer = StemmingAnalyzer() | CharsetFilter(accent_map)
+    names = RegexTokenizer() | LowercaseFilter() | CharsetFilter(accent_map)
+    return dict(md5=ID(stored=True),
+                page=NUMERIC(stored=True),
+                text=TEXT(stored=True, analyzer=analyzer),
+                work=ID(unique=True),
+                key=KEYWORD(lowercase=True),
+                title=TEXT(analyzer=analyzer),
+                author=TEXT(analyzer=names),
+                journal=TEXT(analyzer=analyzer),
+                year=NUMERIC(),
+                doi=KEYWORD(lowercase=True),
+                tag=KEYWORD(lowercase=True, commas=True))
+
+def _splitQuery(q):
+    textQs, metaQs = [], []
+    for c in q.subqueries if isinstance(q, query.And) else [q]:
+        fields = {x.field() for x in c.leaves()}
+        if fields.issubset(metaFields):
+            metaQs.append(c)
+        elif fields.isdisjoint(metaFields):
+            textQs.append(c)
+        else:
+            raise mixedQueryError()
+    return textQs, metaQs
+
+class ANSIFormatter(highlight.Formatter):
+    wsRe = re.compile(r"\s+")
+    def format_token(self, text, token, replace=False):
+        tokentext = highlight.get_text(text, token, replace)
+        return stylize(tokentext, fg('cyan') + attr('bold'))
+
+    def format(self, fragments, replace=False):
+        s = super().format(fragments, replace).strip()
+        s = ' '.join(self.wsRe.split(s))
+        return wrapWithColor(s, firstIndent=4, indent=4)
+
+class WhooshSearch(TextSearch):
+    engine = "whoosh"
+
+    @staticmethod
+    def path(dataDir):
+        return os.path.join(dataDir, ".whoosh")
+
+    @classmethod
+    def exists(cls, dataDir):
+        return os.path.isdir(cls.path(dataDir))
+
+    @staticmethod
+    def _create(pth):
+        try:
+            os.mkdir(pth)
+        except FileExistsError:
+            shutil.rmtree(pth)
+            os.mkdir(pth)
+
+        return widx.create_in(pth, Schema(**_fieldTypes()))
+
+    @classmethod
+    def create(cls, dataDir):
+        cls._create(cls.path(dataDir))
+
+    @classmethod
+    def remove(cls, dataDir):
+        pth = cls.path(dataDir)
+        with FileLock(pth + ".lck", what="full text index"):
+            shutil.rmtree(pth)
+
+    @classmethod
+    def build(cls, dataDir, docs, metaDocs=(), procs=1, limitmb=256):
+        # Builds a fresh index beside the live one and swaps it in, so
+        # searches keep working and a failed rebuild changes nothing. The
+        # live index is only locked for the swap; writes to it while
+        # building are lost, and the caller brings those works up to date.
+        pth = cls.path(dataDir)
+        with FileLock(pth + ".new.lck", what="full text index rebuild"):
+            return cls._build(pth, docs, metaDocs, procs, limitmb)
+
+    @classmethod
+    def _build(cls, pth, docs, metaDocs, procs, limitmb):
+        ix = cls._create(pth + ".new")
+        if procs > 1:
+            writer = ix.writer(procs=procs, limitmb=limitmb, multisegment=False)
+        else:
+            writer = ix.writer(limitmb=limitmb)
+
+        nDocs = nPages = 0
+        try:
+            for md5, pages in docs:
+                for i,page in enumerate(pages):
+                    writer.add_document(md5=md5, page=i, text=page)
+                nDocs += 1
+                nPages += len(pages)
+            for md5, fields in metaDocs:
+                writer.add_document(work=md5, md5=md5, **fields)
+        except BaseException:
+            writer.cancel()
+            shutil.rmtree(pth + ".new")
+            raise
+        writer.commit(optimize=True)
+        ix.close()
+
+        with FileLock(pth + ".lck", what="full text index"):
+            if os.path.exists(pth):
+                os.rename(pth, pth + ".old")
+            os.rename(pth + ".new", pth)
+        shutil.rmtree(pth + ".old", ignore_errors=True)
+        return nDocs, nPages
+
+    def __init__(self, dataDir):
+        self.pth = self.path(dataDir)
+        self.ix = widx.open_dir(self.pth)
+        self._ino = os.stat(self.pth).st_ino
+        self._writer = None
+        self._lock = threading.Lock()
+        self._idle = []
+
+    @contextmanager
+    def searcher(self):
+        # Searchers are kept between calls so segment files and caches stay
+        # warm. Each one is handed to a single caller at a time and refreshed
+        # when a commit has moved the index to a new generation. A rebuilt
+        # index directory (reindex) drops them all.
+        with self._lock:
+            ino = os.stat(self.pth).st_ino
+            if ino != self._ino:
+                for x in self._idle:
+                    x.close()
+                self.ix, self._ino, self._idle = widx.open_dir(self.pth), ino, []
+            s = self._idle.pop() if self._idle else self.ix.searcher()
+            ino = self._ino
+        s = s.refresh()
+        try:
+            yield s
+        finally:
+            with self._lock:
+                if ino == self._ino:
+                    self._idle.append(s)
+                else:
+                    s.close()
+
+    @contextmanager
+    def batch(self, procs=1):
+        if self._writer:
+            yield self._writer
+            return
+
+        # Whoosh's own write lock fails at once when taken; waiting on this
+        # one first makes concurrent writers queue up instead.
+        with FileLock(self.pth + ".lck", what="full text index"):
+            self.ix = widx.open_dir(self.pth)
+            if procs > 1:
+                writer = self.ix.writer(procs=procs, multisegment=True)
+            else:
+                writer = self.ix.writer()
+            with writer:
+                self._writer = writer
+                try:
+                    yield writer
+                finally:
+                    self._writer = None
+
+    def add(self, md5, pages):
+        with self.batch() as writer:
+            for i,page in enumerate(pages):
+                writer.add_document(md5=md5, page=i, text=page)
+
+    @property
+    def fielded(self):
+        return 'work' in self.ix.schema
+
+    def addFields(self, metaDocs):
+        # Indexes made before the metadata fields existed get them added in
+        # place; their page documents are left as they are.
+        with self.batch() as writer:
+            if 'work' in writer.schema:
+                return 0
+            for name, tp in _fieldTypes().items():
+                if name not in writer.schema:
+                    writer.add_field(name, tp)
+            n = 0
+            for md5, fields in metaDocs:
+                writer.add_document(work=md5, md5=md5, **fields)
+                n += 1
+        return n
+
+    def putMeta(self, md5, fields):
+        with self.batch() as writer:
+            writer.update_document(work=md5, md5=md5, **fields)
+
+    def delete(self, md5):
+        with self.batch() as writer:
+            writer.delete_by_term("md5", md5)
+
+    def search(self, term, formatter=None, limit=None, offset=0):
+        if formatter == "html":
+            formatter = highlight.HtmlFormatter(tagname='span', classname='match', between='<span class="searchSep"></span>')
+        elif formatter == "ansi":
+            formatter = ANSIFormatter()
+        else:
+            formatter = highlight.UppercaseFormatter()
+
+        with self.searcher() as searcher:
+            q = QueryParser("text", searcher.schema).parse(expandRanges(term))
+            textQs, metaQs = _splitQuery(q)
+            if metaQs:
+                works = searcher.search(query.And([query.Every('work')] + metaQs), limit=None)
+                if not textQs:
+                    docs = [(hit.score, hit['md5']) for hit in works]
+                    hits = [(md5, score, []) for score, md5 in docs[offset:offset+limit if limit else None]]
+                    return sorted(hits, key=lambda x:x[1]), len(docs)
+                if works.is_empty():
+                    return [], 0
+                q = query.And(textQs)
+                filterQ = query.Or([query.Term('md5', hit['md5']) for hit in works])
+            else:
+                filterQ = None
+
+            # Every matching page is scored and grouped by document, since a
+            # document's score is the sum over its pages; only the documents
+            # in the requested window get highlighted. The mask keeps negated
+            # text queries off the metadata documents, which have no pages.
+            results = searcher.search(q, limit=None, groupedby="md5", filter=filterQ, mask=query.Every('work'))
+            results.fragmenter.charlimit = None
+            results.fragmenter.maxchars = 300
+            results.fragmenter.surround = 50
+            results.formatter = formatter
+
+            pageScores = {docnum: score for score, docnum in results.top_n}
+            docs = [(sum(pageScores[x] for x in docnums), md5, docnums) for md5, docnums in results.groups("md5").items()]
+            docs.sort(key=lambda x: x[0], reverse=True)
+
+            hits = []
+            for score, md5, docnums in docs[offset:offset+limit if limit else None]:
+                fragments = []
+                for docnum in docnums:
+                    hit = Hit(results, docnum, score=pageScores[docnum])
+                    fragments.append(dict(page=hit['page']+1, frag=hit.highlights("text",top=10)))
+                fragments.sort(key=lambda x:x['page'])
+                hits.append( (md5, score, fragments) )
+
+        return sorted(hits, key=lambda x:x[1]), len(docs)